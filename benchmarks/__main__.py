@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from .suite import main
+
+main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import ast
+import json
+import argparse
+from timeit import default_timer
+
+from hamly.parser import parse
+from hamly.compiler import compile_tree
+from hamly.optimizer import optimize, count_nodes
+
+
+HEADER = """\
+- def card(title, body)
+  .card
+    %h3= title
+    %p= body
+"""
+
+BLOCK = """\
+.block{'class': kind, 'id': 'block-INDEX'}
+  +card(title, body)
+  - for i in range(3)
+    %span{'data-i': i}= i
+  %table
+    - for row in rows
+      %tr
+        - for cell in row
+          %td= cell
+"""
+
+
+def make_source(blocks):
+    return HEADER + "".join(BLOCK.replace("INDEX", str(x)) for x in range(blocks))
+
+
+def compile_phases(source):
+    # the phases compile_template runs, without the optional source
+    # generation for template_source which depends on a third party
+    # code generator
+    timings = {}
+    started = default_timer()
+    module = ast.Module(compile_tree(parse(source)))
+    timings["front"] = default_timer() - started
+    nodes = count_nodes(module)
+    started = default_timer()
+    optimized = ast.fix_missing_locations(optimize(module))
+    timings["optimize"] = default_timer() - started
+    started = default_timer()
+    compile(optimized, "<scaling>", "exec")
+    timings["compile"] = default_timer() - started
+    return timings, nodes, count_nodes(optimized)
+
+
+def measure(blocks, repeat):
+    source = make_source(blocks)
+    if sys.version_info[0] < 3:
+        source = source.decode("utf-8")
+    best = None
+    for _ in range(repeat):
+        timings, nodes, nodes_after = compile_phases(source)
+        if best is None:
+            best = timings
+        else:
+            for key, value in timings.items():
+                best[key] = min(best[key], value)
+    total = sum(best.values())
+    return {
+        "blocks": blocks,
+        "lines": source.count("\n"),
+        "nodes": nodes,
+        "nodes_after": nodes_after,
+        "time": total,
+        "phases": best,
+        "us_per_node": total / nodes * 1e6,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compile_scaling",
+                                     description="compile time against template size, prints json")
+    parser.add_argument("--sizes", default="25,50,100,200,400",
+                        help="comma separated block counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = [measure(int(x), args.repeat) for x in args.sizes.split(",")]
+    json.dump({"results": results}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+from timeit import default_timer
+
+from hamly import loader
+
+from .suite import template_path
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def make_templates(directory, count):
+    with open(template_path("macros.haml")) as fp:
+        source = fp.read()
+    names = []
+    for index in range(count):
+        name = os.path.join(directory, "t%i.haml" % index)
+        with open(name, "w") as fp:
+            fp.write(source)
+        names.append(name)
+    return names
+
+
+def stress(names, threads, rounds):
+    # every thread asks for every template at once right after the cache
+    # is emptied, like a threaded server right after a deploy
+    compiles = [0]
+    compile_template = loader.compile_template
+    def counting_compile(*args, **kwargs):
+        compiles[0] += 1
+        return compile_template(*args, **kwargs)
+
+    latencies = []
+    errors = []
+    def worker(start, offset):
+        start.wait()
+        for index in range(len(names)):
+            name = names[(index + offset) % len(names)]
+            started = default_timer()
+            try:
+                loader.get_template(name)
+            except Exception as e:
+                errors.append(repr(e))
+            latencies.append(default_timer() - started)
+
+    loader.compile_template = counting_compile
+    try:
+        started = default_timer()
+        for _ in range(rounds):
+            loader.cache.clear()
+            start = threading.Event()
+            pool = [threading.Thread(target=worker, args=(start, x)) for x in range(threads)]
+            for thread in pool:
+                thread.start()
+            start.set()
+            for thread in pool:
+                thread.join()
+        elapsed = default_timer() - started
+    finally:
+        loader.compile_template = compile_template
+
+    return {
+        "threads": threads,
+        "templates": len(names),
+        "rounds": rounds,
+        "compiles": compiles[0],
+        "expected_compiles": len(names) * rounds,
+        "errors": errors,
+        "time": elapsed,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": max(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.concurrency",
+                                     description="cold get_template calls from many threads, prints json")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="hamly-bench-")
+    try:
+        names = make_templates(directory, args.templates)
+        result = stress(names, args.threads, args.rounds)
+    finally:
+        shutil.rmtree(directory)
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    if result["compiles"] != result["expected_compiles"] or result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+from timeit import default_timer
+
+from hamly.parser import parse
+
+
+BLOCK = """\
+/ section INDEX
+#section-INDEX.section.wide{'data-index': INDEX}
+  %h2.title(title='section INDEX', lang=lang) section INDEX
+  - if show
+    %ul.items
+      - for item in items
+        %li.item{'class': item.kind}= item.name
+  - else
+    %p.empty nothing here
+  + render_footer(INDEX)
+  %p
+    plain text with #{interpolation} INDEX
+"""
+
+
+def make_source(blocks):
+    return "".join(BLOCK.replace("INDEX", str(x)) for x in range(blocks))
+
+
+def measure(blocks, repeat):
+    source = make_source(blocks)
+    if sys.version_info[0] < 3:
+        source = source.decode("utf-8")
+    best = None
+    for _ in range(repeat):
+        started = default_timer()
+        parse(source)
+        elapsed = default_timer() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    lines = source.count("\n")
+    return {
+        "blocks": blocks,
+        "lines": lines,
+        "bytes": len(source),
+        "time": best,
+        "lines_per_second": lines / best,
+        "mb_per_second": len(source) / best / (1 << 20),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.parse_throughput",
+                                     description="parser throughput on large templates, prints json")
+    parser.add_argument("--sizes", default="100,1000,5000",
+                        help="comma separated block counts, a block is 12 lines")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = [measure(int(x), args.repeat) for x in args.sizes.split(",")]
+    json.dump({"results": results}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
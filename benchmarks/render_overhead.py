@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+from timeit import Timer
+
+from hamly.loader import make_template
+
+
+TEMPLATES = {
+    "empty": ("", {}),
+    "static": ("%b hello", {}),
+    "tiny": ("%b= name", {"name": "world"}),
+    "partial": ("%li.item{'data-id': id}\n  %a(href=url)= title", {
+        "id": 7, "url": "/items/7", "title": "item <7>"}),
+}
+
+
+def per_call(fun, number, repeat):
+    return min(Timer(fun).repeat(repeat, number)) / number
+
+
+def measure(name, number, repeat):
+    source, context = TEMPLATES[name]
+    template = make_template(source, "<%s>" % name)
+    args = tuple(context[x] for x in template.arguments)
+    render = template.render_args
+    result = {
+        "template": name,
+        "arguments": list(template.arguments),
+        "render": per_call(lambda: template(**context), number, repeat),
+        "render_args": per_call(lambda: render(*args), number, repeat),
+    }
+    # the cost of calling a python function with that many arguments,
+    # what no entry point can get under
+    def baseline(*args):
+        return args
+    result["baseline"] = per_call(lambda: baseline(*args), number, repeat)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.render_overhead",
+                                     description="fixed cost of one render call in seconds, prints json")
+    parser.add_argument("templates", nargs="*", default=sorted(TEMPLATES))
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = [measure(x, args.number, args.repeat) for x in args.templates]
+    json.dump({"results": results}, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import platform
+import argparse
+from timeit import Timer, default_timer
+
+import hamly
+from hamly.loader import compile_template, make_template, read_source
+
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def template_path(name):
+    return os.path.join(TEMPLATES, name)
+
+
+def deep_context():
+    return {"sections": [{"title": "section %i" % x, "body": "<b>%i</b>" % x}
+                         for x in range(100)]}
+
+
+def table_context():
+    return {"table": [dict(a=1, b=2, c=3, d=4, e=5, f=6, g=7, h=8, i=9, j=10)
+                      for x in range(1000)]}
+
+
+def attrs_context():
+    return {"items": [{"id": "item-%i" % x, "cls": "odd" if x % 2 else "even",
+                       "title": "item <%i>" % x, "url": "/items/%i?a=1&b=2" % x,
+                       "kind": "kind%i" % (x % 3), "value": x, "rank": x * 3}
+                      for x in range(500)]}
+
+
+def macros_context():
+    return {"users": [{"name": "user %i" % x, "email": "user%i@example.com" % x}
+                      for x in range(200)]}
+
+
+def unroll_context():
+    return {"title": "title & more"}
+
+
+def partial_context():
+    return {"count": 42}
+
+
+CASES = [
+    ("deep", "deep.haml", deep_context),
+    ("table", "table.haml", table_context),
+    ("attrs", "attrs.haml", attrs_context),
+    ("dynamic_names", "dynamic_names.haml", attrs_context),
+    ("macros", "macros.haml", macros_context),
+    ("unroll", "unroll.haml", unroll_context),
+    ("partial", "partial.haml", partial_context),
+]
+
+
+def calibrate(timer, minimum=0.2):
+    number = 1
+    while timer.timeit(number) < minimum:
+        number *= 10
+    return number
+
+
+def best(fun, repeat):
+    timer = Timer(fun)
+    number = calibrate(timer)
+    return min(timer.repeat(repeat, number)) / number
+
+
+def measure_compile(filename, repeat):
+    source = read_source(filename)
+    result = {}
+    for _ in range(repeat):
+        stats = {}
+        compile_template(source, filename, stats=stats)
+        timings = dict((key, stats[key]) for key in ("parse", "compile_tree", "optimize", "compile"))
+        # a pass may run more than once, keys carry the pipeline position
+        timings["passes"] = dict(("%02d_%s" % (index, x["name"]), x["time"])
+                                 for index, x in enumerate(stats["optimizer"]["passes"]))
+        if not result:
+            result = timings
+            continue
+        for key, value in timings.items():
+            if key == "passes":
+                for name, time in value.items():
+                    result["passes"][name] = min(result["passes"][name], time)
+            else:
+                result[key] = min(result[key], value)
+    return result
+
+
+def measure_render(filename, context, repeat):
+    template = make_template(read_source(filename), filename)
+    started = default_timer()
+    output = template(**context)
+    first = default_timer() - started
+    return {
+        "first_render": first,
+        "render": best(lambda: template(**context), repeat),
+        "output_size": len(output),
+    }
+
+
+def compare_table(repeat):
+    context = table_context()
+    result = {}
+    try:
+        from jinja2 import Environment, FileSystemLoader
+        j2_template = Environment(loader=FileSystemLoader(TEMPLATES)).get_template("table.html")
+        result["jinja2"] = best(lambda: j2_template.render(**context), repeat)
+    except ImportError:
+        result["jinja2"] = None
+    try:
+        from mako.template import Template
+        mako_template = Template(filename=template_path("table.mako"))
+        result["mako"] = best(lambda: mako_template.render(**context), repeat)
+    except ImportError:
+        result["mako"] = None
+    return result
+
+
+def run(cases=None, repeat=5, compare=False):
+    report = {
+        "meta": {
+            "hamly": hamly.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": {},
+    }
+    for name, filename, context in CASES:
+        if cases and name not in cases:
+            continue
+        filename = template_path(filename)
+        result = {"compile": measure_compile(filename, repeat)}
+        result.update(measure_render(filename, context(), repeat))
+        report["results"][name] = result
+    if compare:
+        report["comparison"] = {"table": compare_table(repeat)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="hamly benchmark suite, prints json")
+    parser.add_argument("cases", nargs="*", help="cases to run: %s" % ", ".join(x[0] for x in CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", action="store_true",
+                        help="render the table case with jinja2 and mako too")
+    parser.add_argument("-o", "--output", help="write json here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.repeat, args.compare)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(data + "\n")
+    else:
+        sys.stdout.write(data + "\n")
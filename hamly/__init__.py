@@ -1,3 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from .loader import get_template
+__version__ = "0.1.1"
+
+from .loader import (get_template, set_bytecode_cache, configure_cache,
+                     configure_compiler, configure_fragment_cache, configure_adaptive,
+                     preload)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from itertools import islice
+
+from six import exec_, iteritems, text_type, integer_types
+
+from .const import NUMBER_HINTS
+
+# elements of a list or dict looked at per render
+SAMPLE = 8
+DEPTH = 3
+
+SCALARS = dict([(x, x.__name__) for x in integer_types] +
+               [(float, "float"), (bool, "bool"), (bytes, "str"), (text_type, "str")])
+
+UNKNOWN = "object"
+
+
+def merge(hints):
+    first = UNKNOWN
+    for index, hint in enumerate(hints):
+        if not index:
+            first = hint
+        elif hint != first:
+            return UNKNOWN
+    return first
+
+
+def observe(value, depth=0):
+    # the hint (as parse_hint returns them) a value would satisfy
+    kind = type(value)
+    if kind in SCALARS:
+        return SCALARS[kind]
+    if depth >= DEPTH:
+        return UNKNOWN
+    if kind is list:
+        return ("list", merge(observe(x, depth + 1) for x in value[:SAMPLE]))
+    if kind is tuple:
+        return ("tuple", ) + tuple(observe(x, depth + 1) for x in value[:SAMPLE])
+    if kind is dict:
+        items = list(islice(iteritems(value), SAMPLE))
+        return ("dict", merge(observe(k, depth + 1) for k, v in items),
+                merge(observe(v, depth + 1) for k, v in items))
+    return UNKNOWN
+
+
+def format_hint(hint):
+    if isinstance(hint, tuple):
+        return "%s[%s]" % (hint[0], ", ".join(format_hint(x) for x in hint[1:]))
+    return hint
+
+
+def has_numbers(hint):
+    if isinstance(hint, tuple):
+        return any(has_numbers(x) for x in hint[1:])
+    return hint in NUMBER_HINTS
+
+
+GUARDED = """
+def guarded(%(args)s_h_write, _h_write_multi):
+    if %(guard)s:
+        _h_paths[2] += 1
+        return _h_fast(%(args)s_h_write, _h_write_multi)
+    _h_paths[3] += 1
+    return _h_generic(%(args)s_h_write, _h_write_multi)
+"""
+
+DISPATCH = """
+def dispatch(%(args)s_h_write, _h_write_multi, **__kw):
+    return _h_state.main(%(args)s_h_write, _h_write_multi)
+"""
+
+
+class Specializer(object):
+    # watches the first renders of a template, then compiles a main for
+    # the types it saw, reached through a type() check of the arguments.
+    # inner values are only checked when written, a list that starts
+    # holding strings is still escaped. path counters are bumped without
+    # a lock and may miss a few renders under threads
+
+    def __init__(self, generic, arguments, load, samples=100, background=True):
+        self.generic = generic
+        self.arguments = arguments
+        self.load = load
+        self.samples = samples
+        self.background = background
+        self.lock = threading.Lock()
+        self.observed = [None] * len(arguments)
+        self.seen = 0
+        self.hints = {}
+        self.error = None
+        self.status = "sampling" if arguments else "generic"
+        # sampled, generic, specialized, guard misses
+        self.paths = [0, 0, 0, 0]
+        self.main = self.sample if arguments else self.unspecialized
+
+    def sample(self, *args):
+        with self.lock:
+            if self.main == self.sample:
+                for index, value in enumerate(args[:len(self.arguments)]):
+                    observed = (type(value), observe(value))
+                    if self.seen and self.observed[index] != observed:
+                        observed = None
+                    self.observed[index] = observed
+                self.seen += 1
+                self.paths[0] += 1
+                if self.seen >= self.samples:
+                    self.main = self.unspecialized
+                    self.status = "compiling"
+                    if self.background:
+                        thread = threading.Thread(target=self.specialize)
+                        thread.daemon = True
+                        thread.start()
+                    else:
+                        self.specialize()
+        return self.generic(*args)
+
+    def unspecialized(self, *args):
+        self.paths[1] += 1
+        return self.generic(*args)
+
+    def specialize(self):
+        guards = []
+        scope = {"_h_paths": self.paths, "_h_generic": self.generic}
+        for index, (name, observed) in enumerate(zip(self.arguments, self.observed)):
+            if observed is not None and has_numbers(observed[1]):
+                self.hints[name] = format_hint(observed[1])
+                scope["_h_type_%i" % index] = observed[0]
+                guards.append("type(%s) is _h_type_%i" % (name, index))
+        if not guards:
+            # nothing a type would save, keep the generic main
+            self.status = "generic"
+            return
+        try:
+            scope["_h_fast"] = self.load(self.hints)
+        except Exception as e:
+            self.error = repr(e)
+            self.status = "generic"
+            return
+        exec_(GUARDED % {"args": "".join(x + ", " for x in self.arguments),
+                         "guard": " and ".join(guards)}, scope)
+        self.main = scope["guarded"]
+        self.status = "specialized"
+
+    def dispatch(self):
+        # a main with the parameter list of the generic one, so positional
+        # renders still work
+        scope = {"_h_state": self}
+        exec_(DISPATCH % {"args": "".join(x + ", " for x in self.arguments)}, scope)
+        return scope["dispatch"]
+
+    def stats(self):
+        return {
+            "status": self.status,
+            "hints": dict(self.hints),
+            "sampled": self.paths[0],
+            "generic": self.paths[1],
+            "specialized": self.paths[2],
+            "guard_misses": self.paths[3],
+            "error": self.error,
+        }
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# python 3.4+ only, imported on the first render_async call
+
+import asyncio
+
+from .stream import CHUNK_SIZE
+
+
+def is_awaitable(value):
+    return asyncio.iscoroutine(value) or isinstance(value, asyncio.Future)
+
+
+@asyncio.coroutine
+def resolve(context):
+    names = [name for name, value in context.items() if is_awaitable(value)]
+    if names:
+        values = yield from asyncio.gather(*[context[name] for name in names])
+        context.update(zip(names, values))
+    return context
+
+
+@asyncio.coroutine
+def render_async(template, sink, chunk_size=CHUNK_SIZE, executor=None, context=None):
+    # the bytes streaming main runs one chunk at a time in an executor, so
+    # the loop keeps serving while a page renders, and the next chunk is
+    # only rendered once the sink took the last one
+    loop = asyncio.get_event_loop()
+    context = yield from resolve(dict(context or {}))
+    chunks = template.generate_bytes(chunk_size, **context)
+    drain = getattr(sink, "drain", None)
+    while True:
+        chunk = yield from loop.run_in_executor(executor, next, chunks, None)
+        if chunk is None:
+            break
+        sink.write(chunk)
+        if drain is not None:
+            yield from drain()
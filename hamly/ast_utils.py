@@ -32,11 +32,38 @@ def scalar_to_ast(value):
         return value
 
 
+def make_bytes(value):
+    if sys.version_info[0] < 3:
+        return ast.Str(value)
+    return ast.Bytes(value)
+
+
 def make_call(name, *args):
     ast_args = [scalar_to_ast(x) for x in args]
     return ast.Call(ast.Name(name, ast.Load()), ast_args, [], None, None)
 
 
+def make_arg(name):
+    if sys.version_info[0] < 3:
+        return ast.Name(name, ast.Param())
+    return ast.arg(name, None)
+
+
+def arg_name(arg):
+    if sys.version_info[0] < 3:
+        return arg.id
+    return arg.arg
+
+
+def add_arg(function, name, default=None):
+    args = function.args
+    if default is None:
+        args.args.insert(len(args.args) - len(args.defaults), make_arg(name))
+    else:
+        args.args.append(make_arg(name))
+        args.defaults.append(default)
+
+
 def make_expr(node):
     return ast.Expr(node)
 
@@ -46,6 +73,16 @@ def make_tuple(*elts):
     return ast.Tuple(ast_elts, ast.Load())
 
 
+def is_join(node):
+    return isinstance(node, ast.Call)\
+        and isinstance(node.func, ast.Attribute)\
+        and node.func.attr == "join"\
+        and isinstance(node.func.value, ast.Str)\
+        and not node.func.value.s\
+        and len(node.args) == 1\
+        and isinstance(node.args[0], ast.ListComp)
+
+
 def make_test(test, body, orelse):
     return ast.IfExp(test, body, orelse)
 
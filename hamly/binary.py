@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import ast
+
+from .const import (WRITE, WRITE_MULTI, WRITE_ATTRS, WRITE_ATTRS_BYTES, ENCODE,
+                    FRAGMENTS, FRAGMENTS_BYTES, FRAGMENT, MERGE_ATTRS, MERGE_ATTRS_BYTES)
+from .ast_utils import make_call, make_bytes, copy_loc, is_join
+from .optimizer import bind_helpers
+
+
+class BytesTransformer(ast.NodeTransformer):
+
+    def encode(self, node):
+        if isinstance(node, ast.Str):
+            return copy_loc(make_bytes(node.s.encode("utf-8")), node)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            node.left = self.encode(node.left)
+            node.right = self.encode(node.right)
+            return node
+        if isinstance(node, ast.Name) and node.id.startswith(FRAGMENT):
+            # cached fragments are already bytes
+            return node
+        if is_join(node):
+            node.func.value = make_bytes(b"")
+            node.args[0].elt = self.encode(node.args[0].elt)
+            return node
+        return make_call(ENCODE, node)
+
+    def visit_Name(self, node):
+        if node.id == FRAGMENTS:
+            return copy_loc(ast.Name(FRAGMENTS_BYTES, node.ctx), node)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name):
+            return node
+        if node.func.id == WRITE:
+            node.args = [self.encode(node.args[0])]
+        elif node.func.id == WRITE_MULTI:
+            data = node.args[0]
+            if hasattr(data, "elts"):
+                data.elts = [self.encode(x) for x in data.elts]
+            elif hasattr(data, "elt"):
+                data.elt = self.encode(data.elt)
+        elif node.func.id == WRITE_ATTRS:
+            node.func = ast.Name(WRITE_ATTRS_BYTES, ast.Load())
+        elif node.func.id == MERGE_ATTRS:
+            node.func = ast.Name(MERGE_ATTRS_BYTES, ast.Load())
+        return node
+
+
+def make_bytes_output(module):
+    return bind_helpers(BytesTransformer().visit(module))
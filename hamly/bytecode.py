@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import errno
+import marshal
+import hashlib
+import tempfile
+
+from . import __version__
+
+
+class BytecodeCache(object):
+
+    suffix = ".hamlyc"
+    # bump when the layout of cached data changes
+    format = "2"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, filename, source, mode=""):
+        digest = hashlib.sha1()
+        for part in (__version__, self.format, sys.version, mode, filename, source):
+            if not isinstance(part, bytes):
+                part = part.encode("utf-8")
+            digest.update(part)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def digest(self, source):
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def load(self, filename, source, mode=""):
+        # returns (code, [(included filename, source digest)]), the caller
+        # checks includes are unchanged
+        try:
+            with open(self.path(self.key(filename, source, mode)), "rb") as fp:
+                return marshal.load(fp)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def dump(self, filename, source, code, mode="", dependencies=()):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                marshal.dump((code, [(name, self.digest(data)) for name, data in dependencies]), fp)
+            os.rename(tmp, self.path(self.key(filename, source, mode)))
+        except (IOError, OSError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from six import reraise
+
+
+def file_stamp(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+class TemplateCache(object):
+
+    def __init__(self, maxsize=1000, auto_reload=False, check_interval=2.0):
+        self.maxsize = maxsize
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def is_stale(self, entry):
+        now = time.time()
+        if now - entry[2] < self.check_interval:
+            return False
+        entry[2] = now
+        for filename, stamp in entry[1].items():
+            if file_stamp(filename) != stamp:
+                return True
+        return False
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.auto_reload and self.is_stale(entry):
+                del self.entries[key]
+                self.reloads += 1
+                self.misses += 1
+                return None
+            self.entries[key] = self.entries.pop(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry and entry[0]
+
+    def set(self, key, value, stamps=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = [value, stamps or {}, time.time()]
+            while self.maxsize and len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reloads": self.reloads,
+        }
+
+
+class FragmentCache(object):
+    # default store of `- cache` blocks, an LRU whose entries expire ttl
+    # seconds after they were set; anything with get(key) returning None
+    # on a miss and set(key, value) can replace it
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[1] is not None and entry[1] < time.time():
+                return None
+            self.entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while self.maxsize and len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Fragments(object):
+    # what compiled `- cache` blocks call, one per output type so text and
+    # bytes renders of a block keep separate entries
+
+    def __init__(self, backend, concat, kind):
+        self.backend = backend
+        self.concat = concat
+        self.kind = kind
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def lookup(self, block, key):
+        value = self.backend.get((self.kind, block, key))
+        with self.lock:
+            counters = self.counters.get(block)
+            if counters is None:
+                counters = self.counters[block] = [0, 0]
+            counters[value is None] += 1
+        return value
+
+    def store(self, block, key, parts):
+        value = self.concat(parts)
+        self.backend.set((self.kind, block, key), value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return dict((block, {"hits": hits, "misses": misses})
+                        for block, (hits, misses) in self.counters.items())
+
+
+class SingleFlight(object):
+    # concurrent calls for the same key wait for the first one and share
+    # its result or exception instead of doing the work again
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fun, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                reraise(*call[2])
+            return call[1]
+        try:
+            call[1] = fun(*args)
+        except Exception:
+            call[2] = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call[0].set()
+        return call[1]
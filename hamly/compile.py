@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+import io
+import sys
+import argparse
+
+from . import __version__, escape, html
+from .loader import (template_tree, to_source, read_source, find_templates,
+                     TEMPLATE_GLOBALS, MODES, RENDER, STREAM, BYTES, BYTES_STREAM)
+from .const import MAIN
+
+
+HEADER = """\
+# -*- coding: utf-8 -*-
+# generated by hamly %(version)s from %(directory)r, do not edit
+
+import sys
+
+import hamly
+from hamly.runtime import TEMPLATE_GLOBALS, wrap_template
+
+HAMLY_VERSION = %(version)r
+PYTHON_VERSION = %(python)r
+
+if hamly.__version__ != HAMLY_VERSION:
+    raise ImportError("templates were compiled by hamly %%s, running %%s, recompile them"
+                      %% (HAMLY_VERSION, hamly.__version__))
+
+# string literals of bytes variants are str on python 2 only
+if sys.version_info[0] != PYTHON_VERSION:
+    raise ImportError("templates were compiled for python %%s, recompile them" %% PYTHON_VERSION)
+
+"""
+
+FOOTER = """
+
+templates = {}
+
+
+def get_template(name):
+    template = templates.get(name)
+    if template is None:
+        template = templates[name] = wrap_template(MAINS[name])
+    return template
+"""
+
+ALL_MODES = (RENDER, STREAM, BYTES, BYTES_STREAM)
+
+
+def function_source(source, filename, mode, name, options):
+    module = template_tree(source, filename, mode, options)
+    module.body[0].name = name
+    code = to_source(module)
+    if not code:
+        raise RuntimeError("writing python source needs astmonkey or codegen installed")
+    if isinstance(code, bytes):
+        code = code.decode("utf-8")
+    return code.strip() + "\n"
+
+
+def helper_source(name, value):
+    # plain functions come from their modules, the fragment objects (the
+    # same ones templates compiled at runtime use) from hamly.runtime
+    for module in (escape, html):
+        for attr, item in sorted(vars(module).items()):
+            if item is value and not attr.startswith("_"):
+                return "from %s import %s as %s\n" % (module.__name__, attr, name)
+    return "%s = TEMPLATE_GLOBALS[%r]\n" % (name, name)
+
+
+def compile_directory(directory, output, modes=ALL_MODES, **options):
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError("unknown mode %r" % mode)
+    names = find_templates(directory)
+    parts = [HEADER % {"version": __version__, "directory": directory,
+                      "python": sys.version_info[0]}]
+    helpers = [helper_source(name, TEMPLATE_GLOBALS[name]) for name in sorted(TEMPLATE_GLOBALS)]
+    # imports first
+    parts.extend(sorted(helpers, key=lambda x: not x.startswith("from ")))
+    table = []
+    for index, name in enumerate(names):
+        filename = os.path.join(directory, name)
+        source = read_source(filename)
+        functions = []
+        for mode in modes:
+            function = "%s_%i_%s" % (MAIN, index, mode)
+            try:
+                parts.append("\n\n" + function_source(source, filename, mode, function, options))
+            except Exception as e:
+                raise RuntimeError("can't compile %s: %s" % (name, e))
+            functions.append("%r: %s" % (mode, function))
+        table.append("    %r: {%s},\n" % (name, ", ".join(functions)))
+    parts.append("\n\nMAINS = {\n%s}\n" % "".join(table))
+    parts.append(FOOTER)
+    with io.open(output, "w", encoding="utf-8") as fp:
+        fp.write(u"".join(parts))
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m hamly.compile",
+                                     description="compile a template directory into a python module")
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", required=True, help="module to write")
+    parser.add_argument("--modes", default=",".join(ALL_MODES),
+                        help="comma separated modes to compile, default: all")
+    parser.add_argument("--format-writes", action="store_true")
+    parser.add_argument("--unroll-budget", type=int,
+                        help="ast nodes loop unrolling may add")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.format_writes:
+        options["format_writes"] = True
+    if args.unroll_budget is not None:
+        options["unroll_budget"] = args.unroll_budget
+
+    names = compile_directory(args.directory, args.output, args.modes.split(","), **options)
+    sys.stderr.write("compiled %i templates into %s\n" % (len(names), args.output))
+
+
+if __name__ == "__main__":
+    main()
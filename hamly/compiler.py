@@ -2,9 +2,11 @@
 
 import ast
 
-from .parser import TagNode, ControlNode, TextNode, OutputNode, StatementNode
-from .const import OPEN_TAG, WRITE, ESCAPE, TO_STRING
-from .ast_utils import make_call, make_expr, make_tuple, ast_True, copy_loc
+from .parser import (TagNode, ControlNode, CacheNode, TextNode, OutputNode, StatementNode,
+                     ContextNode)
+from .const import (OPEN_TAG, WRITE, WRITE_MULTI, ESCAPE, TO_STRING, FRAGMENTS, FRAGMENT,
+                    NUMBER, NUMBER_HINTS)
+from .ast_utils import make_call, make_expr, make_tuple, ast_True, copy_loc, add_arg
 
 
 def dynamic_attrs_to_args(dynamic_attrs):
@@ -19,12 +21,13 @@ def dynamic_attrs_to_args(dynamic_attrs):
 
 
 def tagnode_to_ast(node):
+    # attributes of the same name are joined in this order
     callargs = [ast.Str(node.tagname)]
-    if node.dynamic_attrs:
-        callargs.extend(dynamic_attrs_to_args(node.dynamic_attrs))
     if node.attrs:
         for key, value in node.attrs.items():
             callargs.append(make_tuple(key, value))
+    if node.dynamic_attrs:
+        callargs.extend(dynamic_attrs_to_args(node.dynamic_attrs))
     block = sum([node_to_ast(x) for x in node.children], [make_expr(make_call(OPEN_TAG, *callargs))])
     block.append(make_expr(make_call(WRITE, "</%s>\n" % node.tagname)))
     return block
@@ -40,12 +43,150 @@ def controlnode_to_ast(node):
     return [ctrl]
 
 
+CACHE_BLOCK = """
+{fragment}key = ({key})
+{fragment} = {fragments}.lookup({block!r}, {fragment}key)
+if {fragment} is None:
+    {fragment} = []
+    {fragment} = {fragments}.store({block!r}, {fragment}key, {fragment})
+{write}({fragment})
+"""
+
+
+def cache_depth(nodes):
+    depth = 0
+    for node in nodes:
+        inner = cache_depth(getattr(node, "children", []))
+        if isinstance(node, CacheNode):
+            inner += 1
+        depth = max(depth, inner)
+    return depth
+
+
+def cachenode_to_ast(node):
+    # children are compiled as plain writes so they get optimized (and
+    # encoded for bytes) like the rest, capture_fragments points them at
+    # the fragment afterwards; nested blocks get their own names
+    if node.orelse:
+        raise RuntimeError("cache can't have else near line %i" % node.line.num)
+    code = CACHE_BLOCK.format(fragment="%s%i_" % (FRAGMENT, cache_depth(node.children)),
+                              key=node.key, fragments=FRAGMENTS, block=node.block or str(node.line.num),
+                              write=WRITE)
+    block = ast.parse(code).body
+    miss = block[2]
+    miss.body[1:1] = sum([node_to_ast(x) for x in node.children], [])
+    return block
+
+
+CAPTURE = "{fragment}write, {fragment}write_multi = {fragment}.append, {fragment}.extend"
+
+
+WRITERS = (WRITE, WRITE_MULTI)
+
+
+def takes_writers(node):
+    return any(getattr(x, "id", getattr(x, "arg", None)) == WRITE for x in node.args.args)
+
+
+class RenameWriters(ast.NodeTransformer):
+
+    def __init__(self, names):
+        self.names = names
+        super(RenameWriters, self).__init__()
+
+    def visit_FunctionDef(self, node):
+        if not takes_writers(node):
+            return self.generic_visit(node)
+        # the body writes through its own arguments
+        node.args.defaults = [self.visit(x) for x in node.args.defaults]
+        return node
+
+    def visit_Name(self, node):
+        if node.id in self.names and isinstance(node.ctx, ast.Load):
+            return copy_loc(ast.Name(self.names[node.id], node.ctx), node)
+        return node
+
+
+class PassWriters(ast.NodeTransformer):
+    # defs left after inlining write through the writers of the scope they
+    # are defined in. they take the writers as arguments instead, and every
+    # call passes the ones of the caller, so renaming the writers inside a
+    # cache block reaches the macros it calls too
+
+    def __init__(self, names):
+        self.names = names
+        super(PassWriters, self).__init__()
+
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        if node.name in self.names:
+            for name in WRITERS:
+                add_arg(node, name, ast.Name(name, ast.Load()))
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in self.names:
+            node.keywords.extend(ast.keyword(x, ast.Name(x, ast.Load())) for x in WRITERS)
+        return node
+
+
+class FragmentCapture(ast.NodeTransformer):
+    # the writers used inside a cache block become locals appending to the
+    # fragment, rebinding _h_write itself would make it a local of any
+    # def the block is in
+
+    def __init__(self, fixed=()):
+        # defs that can't take the writers (*args)
+        self.fixed = fixed
+        super(FragmentCapture, self).__init__()
+
+    def is_miss(self, node):
+        test = node.test
+        return isinstance(test, ast.Compare)\
+            and isinstance(test.left, ast.Name)\
+            and test.left.id.startswith(FRAGMENT)\
+            and len(test.ops) == 1\
+            and isinstance(test.ops[0], ast.Is)
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        if not self.is_miss(node):
+            return node
+        inner = node.body[1:-1]
+        for item in inner:
+            for call in ast.walk(item):
+                if isinstance(call, ast.Call) and getattr(call.func, "id", None) in self.fixed:
+                    raise RuntimeError("def %s takes *args, it can't be called from the cache block near line %i"
+                                       % (call.func.id, node.lineno - 1))
+        fragment = node.test.left.id
+        rename = RenameWriters({WRITE: fragment + "write", WRITE_MULTI: fragment + "write_multi"})
+        inner = [rename.visit(x) for x in inner]
+        bind = ast.parse(CAPTURE.format(fragment=fragment)).body
+        node.body = node.body[:1] + copy_loc(bind, node) + inner + node.body[-1:]
+        return node
+
+
+def capture_fragments(module):
+    main = module.body[0]
+    capture = FragmentCapture()
+    if not any(isinstance(x, ast.If) and capture.is_miss(x) for x in ast.walk(main)):
+        return module
+    defs = [x for x in ast.walk(main) if isinstance(x, ast.FunctionDef) and x is not main]
+    capture.fixed = set(x.name for x in defs if x.args.vararg)
+    module = PassWriters(set(x.name for x in defs if not x.args.vararg)).visit(module)
+    return capture.visit(module)
+
+
 def textnode_to_ast(node):
     return [make_expr(make_call(WRITE, node.text + "\n"))]
 
 
 def outputnode_to_ast(node):
     value = ast.parse(node.expr).body[0].value
+    if node.hint in NUMBER_HINTS:
+        return [make_expr(make_call(WRITE, make_call(NUMBER, value))),
+                make_expr(make_call(WRITE, "\n"))]
     return [make_expr(make_call(WRITE, make_call(ESCAPE, value))),
             make_expr(make_call(WRITE, "\n"))]
 
@@ -62,6 +203,8 @@ def node_to_ast(node):
     def _block():
         if isinstance(node, TagNode):
             return tagnode_to_ast(node)
+        elif isinstance(node, CacheNode):
+            return cachenode_to_ast(node)
         elif isinstance(node, ControlNode):
             return controlnode_to_ast(node)
         elif isinstance(node, TextNode):
@@ -70,6 +213,9 @@ def node_to_ast(node):
             return outputnode_to_ast(node)
         elif isinstance(node, StatementNode):
             return statementnode_to_ast(node)
+        elif isinstance(node, ContextNode):
+            # read by template_tree, nothing to render
+            return []
         else:
             raise RuntimeError("can't convert %r to ast" % node)
     try:
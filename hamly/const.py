@@ -5,4 +5,19 @@ ESCAPE = "_h_escape"
 TO_STRING = "_h_to_string"
 QUOTEATTR = "_h_quoteattr"
 WRITE_ATTRS = "_h_write_attrs"
-MAIN = "_h_main"
\ No newline at end of file
+MAIN = "_h_main"
+ENCODE = "_h_encode"
+WRITE_ATTRS_BYTES = "_h_write_attrs_bytes"
+HOIST = "_h_hoist_"
+FLUSH = "_h_flush"
+CHUNK = "_h_chunk"
+FRAGMENTS = "_h_fragments"
+FRAGMENTS_BYTES = "_h_fragments_bytes"
+FRAGMENT = "_h_fragment_"
+MERGE_ATTRS = "_h_merge_attrs"
+MERGE_ATTRS_BYTES = "_h_merge_attrs_bytes"
+NUMBER = "_h_number"
+NUMBER_ATTR = "_h_number_attr"
+TRIPS = "_h_trips"
+# context hints of values that are stringified instead of escaped
+NUMBER_HINTS = ("int", "long", "float", "bool")
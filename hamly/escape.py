@@ -20,3 +20,29 @@ except ImportError:
 
     def quoteattr(at):
         return soft_unicode(at).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&#34;").replace("'", "&#39;")
+
+
+if sys.version_info[0] < 3:
+    def encode(s):
+        return s.encode("utf-8")
+else:
+    encode = str.encode
+
+
+if sys.version_info[0] < 3:
+    NUMBER_TYPES = (int, long, float, bool)
+else:
+    NUMBER_TYPES = (int, float, bool)
+
+
+def number(value):
+    # context hints promised a number, anything else is escaped after all
+    if type(value) in NUMBER_TYPES:
+        return soft_unicode(value)
+    return escape(value)
+
+
+def number_attr(value):
+    if type(value) in NUMBER_TYPES:
+        return soft_unicode(value)
+    return quoteattr(value)
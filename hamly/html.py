@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import ast
+from operator import itemgetter
 
-from .escape import quoteattr
+from .escape import quoteattr, encode
+
+
+# attribute shape (positions, names) -> (format, value order)
+ATTRS_FORMATS = {}
+ATTRS_FORMATS_LIMIT = 1000
+
+by_name = itemgetter(0)
 
 
 def write_attrs_ast(attrs, _write):
     _atname = None
-    for name, value in sorted(attrs):
+    for name, value in sorted(attrs, key=by_name):
         if name:
             if name != _atname:
                 if _atname:
@@ -23,7 +31,7 @@ def write_attrs_ast(attrs, _write):
 
 def write_attrs(attrs, _write):
     _atname = None
-    for name, value in sorted(attrs):
+    for name, value in sorted(attrs, key=by_name):
         if name:
             if name != _atname:
                 if _atname:
@@ -35,3 +43,58 @@ def write_attrs(attrs, _write):
             _atname = name
     if _atname:
         _write("'")
+
+
+def write_attrs_bytes(attrs, _write):
+    data = []
+    write_attrs(attrs, data.append)
+    _write(encode("".join(data)))
+
+
+def attrs_format(names, positions):
+    # the same layout write_attrs produces, as one format string and a
+    # getter picking the quoted values for it; positions are where the
+    # pairs stood in the tag, values of a repeated name keep that order
+    order = sorted(range(len(names)), key=lambda x: (names[x], positions[x]))
+    order = [x for x in order if names[x]]
+    parts = []
+    _atname = None
+    for index in order:
+        name = names[index]
+        if name != _atname:
+            if _atname:
+                parts.append("'")
+            parts.append(" %s='" % ("%s" % (name, )).replace("%", "%%"))
+        else:
+            parts.append(" ")
+        parts.append("%s")
+        _atname = name
+    if _atname:
+        parts.append("'")
+    if len(order) == 1:
+        index = order[0]
+        return "".join(parts), lambda values: (values[index], )
+    return "".join(parts), itemgetter(*order) if order else lambda values: ()
+
+
+def merge_attrs(names, values, positions, pairs):
+    # names and quoted values of the pairs with static names come from
+    # the compiler, the pairs with dynamic names are merged in here
+    for name, value in pairs:
+        names += (name, )
+        values += (quoteattr(value), )
+    key = (positions, names)
+    entry = ATTRS_FORMATS.get(key)
+    if entry is None:
+        if len(ATTRS_FORMATS) >= ATTRS_FORMATS_LIMIT:
+            ATTRS_FORMATS.clear()
+        entry = ATTRS_FORMATS[key] = attrs_format(names, positions)
+    return entry[0] % entry[1](values)
+
+
+def write_merged_attrs(names, values, positions, pairs, _write):
+    _write(merge_attrs(names, values, positions, pairs))
+
+
+def write_merged_attrs_bytes(names, values, positions, pairs, _write):
+    _write(encode(merge_attrs(names, values, positions, pairs)))
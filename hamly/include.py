@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import ast
+
+from .parser import parse, IncludeNode, ImportNode, ControlNode, CacheNode
+from .compiler import node_to_ast
+
+
+DEF = re.compile(r'^def\s+(\w+)')
+
+
+def def_name(node):
+    match = isinstance(node, ControlNode) and DEF.match(node.code)
+    return match.group(1) if match else None
+
+
+def used_names(node):
+    return set(x.id for item in node_to_ast(node) for x in ast.walk(item) if isinstance(x, ast.Name))
+
+
+class IncludeResolver(object):
+    # splices included templates and imported macros into the node tree
+    # before it is compiled, so they get optimized like local code
+
+    def __init__(self, read, dependencies=None):
+        self.read = read
+        if dependencies is None:
+            dependencies = []
+        self.dependencies = dependencies
+        self.stack = []
+
+    def path(self, filename, name):
+        return os.path.normpath(os.path.join(os.path.dirname(filename), name))
+
+    def load(self, filename, node):
+        if filename in self.stack:
+            raise RuntimeError("recursive include of %s near line %s" % (filename, node.line.num))
+        try:
+            source = self.read(filename)
+        except (IOError, OSError) as e:
+            raise RuntimeError("can't include %s near line %s: %s" % (filename, node.line.num, e))
+        if filename not in [x[0] for x in self.dependencies]:
+            self.dependencies.append((filename, source))
+        self.stack.append(filename)
+        nodes = self.resolve(parse(source), filename)
+        self.stack.pop()
+        return nodes
+
+    def macros(self, node, filename, defined):
+        defs = {}
+        order = []
+        for item in self.load(filename, node):
+            name = def_name(item)
+            if name:
+                defs[name] = item
+                order.append(name)
+        for name in node.names:
+            if name not in defs:
+                raise RuntimeError("%s has no def %s near line %s" % (filename, name, node.line.num))
+        # the imported defs come along with the ones they call
+        wanted = set()
+        pending = list(node.names)
+        while pending:
+            name = pending.pop()
+            if name not in wanted:
+                wanted.add(name)
+                pending.extend(x for x in used_names(defs[name]) if x in defs)
+        result = []
+        for name in order:
+            if name not in wanted or defined.get(name) == filename:
+                continue
+            if name in defined:
+                raise RuntimeError("def %s from %s near line %s clashes with the one from %s"
+                                   % (name, filename, node.line.num, defined[name]))
+            defined[name] = filename
+            result.append(defs[name])
+        return result
+
+    def resolve(self, nodes, filename):
+        result = []
+        # def name -> file it comes from, imports must not replace a def
+        defined = dict((def_name(x), filename) for x in nodes if def_name(x))
+        for node in nodes:
+            if isinstance(node, IncludeNode):
+                result.extend(self.load(self.path(filename, node.path), node))
+            elif isinstance(node, ImportNode):
+                result.extend(self.macros(node, self.path(filename, node.path), defined))
+            else:
+                if isinstance(node, CacheNode):
+                    node.block = "%s:%i" % (filename, node.line.num)
+                if hasattr(node, "children"):
+                    node.children = self.resolve(node.children, filename)
+                if hasattr(node, "orelse"):
+                    node.orelse = self.resolve(node.orelse, filename)
+                result.append(node)
+        return result
+
+
+def parse_template(source, filename, read, dependencies=None):
+    resolver = IncludeResolver(read, dependencies)
+    resolver.stack.append(filename)
+    return resolver.resolve(parse(source), filename)
@@ -1,71 +1,372 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import ast
+import copy
+import hashlib
+import marshal
+import traceback
+from timeit import default_timer
 
 from six import exec_
 
-from .escape import escape, quoteattr, soft_unicode
-from .html import write_attrs
-from .parser import parse
-from .compiler import compile_tree
-from .optimizer import optimize
-from .const import (WRITE, TO_STRING, ESCAPE, WRITE_MULTI,
-                    QUOTEATTR, WRITE_ATTRS, MAIN)
+from .bytecode import BytecodeCache
+from .cache import TemplateCache, SingleFlight, file_stamp
+from .adaptive import Specializer
+# configure_fragment_cache and fragment_stats are public from here too
+from .runtime import (RENDER, STREAM, BYTES, BYTES_STREAM, TEMPLATE_GLOBALS,
+                      configure_fragment_cache, fragment_stats, code_size,
+                      main_arguments, wrap_template)
+from .const import MAIN
 
-cache = {}
+# transforms of the optimized tree per mode, by name so the compile
+# pipeline is only imported once something gets compiled
+MODES = {
+    RENDER: (),
+    STREAM: ("streaming", ),
+    BYTES: ("bytes", ),
+    BYTES_STREAM: ("bytes", "streaming"),
+}
 
-def get_template(filename):
-    cached = cache.get(filename)
+cache = TemplateCache()
+flights = SingleFlight()
+bytecode_cache = None
+compile_options = {}
+adaptive_options = {}
+
+
+def configure_cache(maxsize=1000, auto_reload=False, check_interval=2.0):
+    global cache
+    cache = TemplateCache(maxsize, auto_reload, check_interval)
+
+
+def set_bytecode_cache(directory):
+    global bytecode_cache
+    if directory:
+        bytecode_cache = BytecodeCache(directory)
+    else:
+        bytecode_cache = None
 
-    if not cached:
 
-        with open(filename) as fp:
-            source = fp.read()
+def configure_compiler(**options):
+    compile_options.clear()
+    compile_options.update(options)
+    cache.clear()
 
-        if sys.version_info[0] < 3:
-            source = source.decode("utf-8")
 
-        tree = parse(source)
-        compiled = compile_tree(tree)
-        module = ast.Module(compiled)
-        optimized = optimize(module)
+def configure_adaptive(samples=100, background=True):
+    # templates loaded afterwards watch their first renders and recompile
+    # for the context types seen, samples=0 turns it off
+    adaptive_options.clear()
+    if samples:
+        adaptive_options.update(samples=samples, background=background)
+    cache.clear()
 
-        template_source = ""
+
+def to_source(tree):
+    # source generators may annotate nodes in place (astmonkey links
+    # parents), including the ctx singletons shared by every parsed tree
+    tree = copy.deepcopy(tree)
+    try:
+        from astmonkey import visitors
+        return visitors.to_source(tree)
+    except ImportError:
         try:
-            from astmonkey import visitors
-            template_source = visitors.to_source(optimized)
+            import codegen
+            return codegen.to_source(tree)
         except ImportError:
-            try:
-                import codegen
-                template_source = codegen.to_source(optimized)
-            except ImportError:
-                template_source = ""
-
-        code = compile(ast.fix_missing_locations(optimized), filename, "exec")
-
-        globs = {
-            ESCAPE: escape,
-            QUOTEATTR: quoteattr,
-            TO_STRING: soft_unicode,
-            WRITE_ATTRS: write_attrs
-        }        
-
-        scope = {}
-        exec_(code, globs, scope)
-        main_fun = scope[MAIN]
-        concat = "".join
-
-        def render(**kwargs):
-            output = []
-            context = {WRITE: output.append, WRITE_MULTI: output.extend}
-            context.update(kwargs)
-            main_fun(**context)
-            return concat(output)
-
-        setattr(render, "template_source", template_source)
-
-        cached = render
-        cache[filename] = cached
+            return ""
+
+
+def timed(timings, key, fun, *args, **kwargs):
+    if timings is None:
+        return fun(*args, **kwargs)
+    started = default_timer()
+    result = fun(*args, **kwargs)
+    timings[key] = default_timer() - started
+    return result
+
+
+def context_hints(tree):
+    from .parser import ContextNode
+    hints = {}
+    for node in tree:
+        if isinstance(node, ContextNode):
+            hints.update(node.hints)
+    return hints
+
+
+def template_tree(source, filename, mode=RENDER, options=None, stats=None, dependencies=None):
+    from .include import parse_template
+    from .compiler import compile_tree, capture_fragments
+    from .optimizer import optimize
+    from .stream import make_streaming
+    from .binary import make_bytes_output
+    transforms = {"streaming": make_streaming, "bytes": make_bytes_output}
+    tree = timed(stats, "parse", parse_template, source, filename, read_source, dependencies)
+    options = dict(options or {})
+    if "bytes" in MODES[mode]:
+        # there are no bytes f-strings, static parts stay pre-encoded
+        options.pop("format_writes", None)
+    # what the template declares wins over observed types
+    type_hints = dict(options.pop("type_hints", None) or {})
+    type_hints.update(context_hints(tree))
+    compiled = timed(stats, "compile_tree", compile_tree, tree)
+    module = ast.Module(compiled)
+    optimizer_stats = None
+    if stats is not None:
+        optimizer_stats = stats["optimizer"] = {}
+    optimized = timed(stats, "optimize", optimize, module, stats=optimizer_stats,
+                      type_hints=type_hints, streaming="streaming" in MODES[mode], **options)
+    for transform in MODES[mode]:
+        optimized = transforms[transform](optimized)
+    optimized = capture_fragments(optimized)
+    return ast.fix_missing_locations(optimized)
+
+
+def compile_template(source, filename, mode=RENDER, options=None, stats=None, dependencies=None):
+    optimized = template_tree(source, filename, mode, options, stats, dependencies)
+    template_source = ""
+    if mode == RENDER:
+        template_source = to_source(optimized)
+    code = timed(stats, "compile", compile, optimized, filename, "exec")
+    if stats is not None:
+        stats["code_size"] = code_size(code)
+    return code, template_source
+
+
+def read_source(filename):
+    with open(filename) as fp:
+        source = fp.read()
+    if sys.version_info[0] < 3:
+        source = source.decode("utf-8")
+    return source
+
+
+def find_templates(directory, suffix=".haml"):
+    names = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(suffix):
+                path = os.path.relpath(os.path.join(root, filename), directory)
+                names.append(path.replace(os.sep, "/"))
+    return names
+
+
+def canonical(value):
+    if isinstance(value, dict):
+        return "{%s}" % ", ".join(sorted("%s: %s" % (canonical(k), canonical(v))
+                                         for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return "%s(%s)" % (type(value).__name__, ", ".join(canonical(x) for x in value))
+    return repr(value)
+
+
+def fingerprint(static_context):
+    # equal for equal contexts, whatever order their dicts are in
+    return hashlib.sha1(canonical(static_context).encode("utf-8")).hexdigest()
+
+
+def current_options(mode=RENDER, static_context=None, type_hints=None):
+    options = dict(compile_options)
+    options.pop("profile", None)
+    cache_mode = mode
+    if options:
+        cache_mode = "%s:%r" % (mode, sorted(options.items()))
+    if static_context:
+        options["static_context"] = static_context
+        cache_mode = "%s:static=%s" % (cache_mode, fingerprint(static_context))
+    if type_hints:
+        options["type_hints"] = type_hints
+        cache_mode = "%s:hints=%s" % (cache_mode, fingerprint(type_hints))
+    return options, cache_mode
+
+
+def fresh_dependencies(dependencies):
+    for filename, digest in dependencies:
+        try:
+            if bytecode_cache.digest(read_source(filename)) != digest:
+                return False
+        except (IOError, OSError):
+            return False
+    return True
+
+
+def load_cached(source, filename, cache_mode):
+    cached = bytecode_cache.load(filename, source, cache_mode)
+    if cached is None or not fresh_dependencies(cached[1]):
+        return None
+    return cached[0], [x[0] for x in cached[1]]
+
+
+def load_code(source, filename, mode=RENDER, stats=None, static_context=None, type_hints=None):
+    cached = None
+    template_source = ""
+    options, cache_mode = current_options(mode, static_context, type_hints)
+    if bytecode_cache and stats is None:
+        cached = load_cached(source, filename, cache_mode)
+    if cached is not None:
+        code, dependencies = cached
+    else:
+        included = []
+        code, template_source = compile_template(source, filename, mode, options, stats, included)
+        if bytecode_cache:
+            bytecode_cache.dump(filename, source, code, cache_mode, included)
+        dependencies = [x[0] for x in included]
+    return code, template_source, dependencies
+
+
+def exec_main(code):
+    scope = {}
+    exec_(code, dict(TEMPLATE_GLOBALS), scope)
+    return scope[MAIN]
+
+
+def load_main(source, filename, mode=RENDER, stats=None, static_context=None, type_hints=None):
+    code, template_source, dependencies = load_code(source, filename, mode, stats, static_context,
+                                                    type_hints)
+    return exec_main(code), template_source
+
+
+def make_template(source, filename, code=None, template_source="", dependencies=(),
+                  static_context=None):
+    stats = None
+    static_context = dict(static_context or {})
+    if code is None:
+        if compile_options.get("profile"):
+            stats = {}
+        code, template_source, dependencies = load_code(source, filename, stats=stats,
+                                                        static_context=static_context)
+
+    def load(mode):
+        return load_main(source, filename, mode, static_context=static_context)[0]
+
+    def load_specialized(type_hints):
+        return load_main(source, filename, static_context=static_context, type_hints=type_hints)[0]
+
+    main = exec_main(code)
+    specializer = None
+    if adaptive_options:
+        specializer = Specializer(main, main_arguments(main), load_specialized, **adaptive_options)
+        main = specializer.dispatch()
+
+    render = wrap_template({RENDER: main}, load)
+    setattr(render, "template_source", template_source)
+    setattr(render, "compile_stats", stats)
+    setattr(render, "dependencies", list(dependencies))
+    setattr(render, "static_context", static_context)
+    if specializer is not None:
+        setattr(render, "code_size", code_size(specializer.generic.__code__))
+        setattr(render, "specialization_stats", specializer.stats)
+    return render
+
+
+def template_stamps(filename, stamp, template):
+    stamps = dict((x, file_stamp(x)) for x in template.dependencies)
+    stamps[filename] = stamp
+    return stamps
+
+
+def template_key(filename, static_context):
+    # specialized variants are cached apart from the plain template
+    if static_context:
+        return filename, fingerprint(static_context)
+    return filename
+
+
+def load_template(filename, static_context=None):
+    key = template_key(filename, static_context)
+    # another thread may have finished loading it since our cache miss
+    cached = cache.peek(key)
+
+    if not cached:
+
+        stamp = file_stamp(filename)
+        source = read_source(filename)
+        cached = make_template(source, filename, static_context=static_context)
+        cache.set(key, cached, template_stamps(filename, stamp, cached))
+
+    return cached
+
+
+def get_template(filename, static_context=None):
+    key = template_key(filename, static_context)
+    cached = cache.get(key)
+
+    if not cached:
+        cached = flights.do(key, load_template, filename, static_context)
 
     return cached
+
+
+def compile_job(job):
+    filename, options = job
+    started = default_timer()
+    included = []
+    try:
+        code, template_source = compile_template(read_source(filename), filename,
+                                                 options=options, dependencies=included)
+        return (filename, marshal.dumps(code), template_source, included,
+                default_timer() - started, None)
+    except Exception:
+        return filename, None, "", [], default_timer() - started, traceback.format_exc()
+
+
+def pool_map(fun, jobs, workers):
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        try:
+            for result in pool.imap_unordered(fun, jobs):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(fun, jobs):
+            yield result
+
+
+def preload(directory, workers=None):
+    started = default_timer()
+    report = {"templates": {}, "failures": {}}
+    options, cache_mode = current_options()
+    sources = {}
+    jobs = []
+    for name in find_templates(directory):
+        filename = os.path.join(directory, name)
+        stamp = file_stamp(filename)
+        source = read_source(filename)
+        cached = None
+        if bytecode_cache:
+            cached = load_cached(source, filename, cache_mode)
+        if cached is None:
+            sources[filename] = source, stamp
+            jobs.append((filename, options))
+        else:
+            code, dependencies = cached
+            template = make_template(source, filename, code, dependencies=dependencies)
+            cache.set(filename, template, template_stamps(filename, stamp, template))
+            report["templates"][filename] = {"time": 0.0, "cached": True}
+
+    results = pool_map(compile_job, jobs, workers)
+    for filename, data, template_source, included, elapsed, error in results:
+        if error is not None:
+            report["failures"][filename] = error
+            continue
+        source, stamp = sources[filename]
+        code = marshal.loads(data)
+        if bytecode_cache:
+            bytecode_cache.dump(filename, source, code, cache_mode, included)
+        template = make_template(source, filename, code, template_source,
+                                 [x[0] for x in included])
+        cache.set(filename, template, template_stamps(filename, stamp, template))
+        report["templates"][filename] = {"time": elapsed, "cached": False}
+
+    report["time"] = default_timer() - started
+    return report
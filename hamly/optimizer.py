@@ -3,21 +3,55 @@
 import re
 import ast
 import sys
-import copy
+from itertools import islice
+from operator import itemgetter
+from timeit import default_timer
 
 from six import exec_
+from six.moves import range as lazy_range
 
 from .const import (OPEN_TAG, WRITE, ESCAPE, TO_STRING,
-                    WRITE_MULTI, QUOTEATTR, WRITE_ATTRS, MAIN)
+                    WRITE_MULTI, QUOTEATTR, WRITE_ATTRS, MAIN, HOIST,
+                    ENCODE, WRITE_ATTRS_BYTES, FRAGMENTS, FRAGMENTS_BYTES,
+                    MERGE_ATTRS, MERGE_ATTRS_BYTES, NUMBER, NUMBER_ATTR,
+                    NUMBER_HINTS, TRIPS)
 from .ast_utils import (make_call, make_expr, make_tuple, ast_True,
-                        make_cond, copy_loc, scalar_to_ast, defines_functions, )
-from .escape import quoteattr, escape, soft_unicode
-from .html import write_attrs, write_attrs_ast
+                        make_cond, copy_loc, scalar_to_ast, defines_functions,
+                        make_arg, is_join, arg_name, add_arg, )
+from .escape import quoteattr, escape, soft_unicode, number, number_attr
+from .html import write_attrs, write_attrs_ast, write_merged_attrs
 
 
-INTERNALS = [WRITE, OPEN_TAG, WRITE_MULTI, QUOTEATTR, WRITE_ATTRS, ESCAPE,
+INTERNALS = [WRITE, OPEN_TAG, WRITE_MULTI, QUOTEATTR, WRITE_ATTRS, MERGE_ATTRS, ESCAPE, FRAGMENTS,
+             NUMBER, NUMBER_ATTR,
              "True", "False", "None", "range", "xrange", "enumerate", "len", "dict"]
 
+HELPERS = [ESCAPE, QUOTEATTR, TO_STRING, WRITE_ATTRS, WRITE_ATTRS_BYTES, ENCODE,
+           FRAGMENTS, FRAGMENTS_BYTES, MERGE_ATTRS, MERGE_ATTRS_BYTES,
+           NUMBER, NUMBER_ATTR]
+
+PURE_FUNCTIONS = INTERNALS + [TO_STRING]
+
+CONSTANT_TYPES = (bool, int, float, type(None)) + ((str, unicode, long) if sys.version_info[0] < 3 else (str, ))
+
+PURE_METHODS = ["items", "keys", "values", "iteritems", "iterkeys", "itervalues", "get"]
+
+UNROLL_BUDGET = 20000
+
+FOLD_LIMIT = 1 << 20
+
+# loop iterations one compile time evaluation may run
+FOLD_TRIPS = 100000
+
+
+def count(optimizer, event, number=1):
+    counters = optimizer.__dict__.setdefault("counters", {})
+    counters[event] = counters.get(event, 0) + number
+
+
+def count_nodes(node):
+    return sum(1 for _ in ast.walk(node))
+
 
 class NameExtractorVisitor(ast.NodeVisitor):
 
@@ -37,69 +71,130 @@ class NameExtractorVisitor(ast.NodeVisitor):
         return extractor.names
 
 
-class NameCollectorVisitor(ast.NodeVisitor):
+class TreeAnalysis(object):
+    # bottom-up facts about subtrees memoized by node identity, entries
+    # keep their node alive so ids aren't reused. passes mutate nodes,
+    # each pass gets its own instance
 
     def __init__(self):
-        self.names = []
-        self.locals = [[]]
-        super(NameCollectorVisitor, self).__init__()
-
-    def visit_For(self, node):
-        target_names = NameExtractorVisitor.extract_names(node.target)
-        self.visit(node.iter)
-        self.locals.append(target_names)
-        self.locals.append([])
-        for child in node.body:
-            self.visit(child)
-        self.locals.pop()
-        self.locals.pop()
-
-    def visit_Name(self, node):
-        if isinstance(node.ctx, ast.Load):
-            name = node.id
-            if name not in INTERNALS:
-                for local in self.locals:
-                    if name in local:
-                        break
-                else:
-                    self.names.append(name)
-        elif isinstance(node.ctx, ast.Store):
-            self.locals[-1].append(node.id)
-
-    def visit_ListComp(self, node):
-        for gen in node.generators:
-            self.visit(gen)
-        gen_names_extractor = NameExtractorVisitor()
-        for gen in node.generators:
-            gen_names_extractor.visit(gen)
-        self.locals.append(gen_names_extractor.names)
-        self.locals.append([])
-        self.visit(node.elt)
-        self.locals.pop()
-        self.locals.pop()
-
-    def visit_FunctionDef(self, node):
-        param_names = NameExtractorVisitor.extract_names(node.args)
-        self.locals[-1].append(node.name)
-        self.locals.append(param_names)
-        self.locals.append([])
-        for child in node.body:
-            self.visit(child)
-        self.locals.pop()
-        self.locals.pop()
-
-
-class StaticTreeVisitor(object):
-
-    @classmethod
-    def is_static(cls, node):
-        collector = NameCollectorVisitor()
-        collector.visit(node)
-        return not collector.names
+        self.scopes = {}
+        self.stores = {}
+        self.safe = {}
+        self.sizes = {}
+
+    def memoized(self, memo, fun, node):
+        entry = memo.get(id(node))
+        if entry is None:
+            entry = memo[id(node)] = (node, fun(node))
+        return entry[1]
+
+    def sequence(self, scopes):
+        free = set()
+        stores = set()
+        for child_free, child_stores in scopes:
+            free.update(child_free - stores)
+            stores.update(child_stores)
+        return free, stores
+
+    def children(self, nodes):
+        return [self.scope(x) for x in nodes]
+
+    def params(self, args):
+        names = set(self.stored_names(args))
+        for name in (args.vararg, args.kwarg):
+            if name is not None:
+                names.add(arg_name(name) if isinstance(name, ast.AST) else name)
+        return names
+
+    def _scope(self, node):
+        # stores shadow later loads, loop and function bodies get their
+        # own frame and comprehension targets leak like on python 2
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                if node.id in INTERNALS:
+                    return set(), set()
+                return set([node.id]), set()
+            if isinstance(node.ctx, ast.Store):
+                return set(), set([node.id])
+            return set(), set()
+        if isinstance(node, ast.For):
+            body_free = self.sequence(self.children(node.body))[0]
+            body_free -= self.stored_names(node.target)
+            return self.sequence([self.scope(node.iter), (body_free, set())])
+        if isinstance(node, ast.ListComp):
+            gen_names = set()
+            for gen in node.generators:
+                gen_names.update(self.stored_names(gen))
+            elt_free = self.scope(node.elt)[0] - gen_names
+            return self.sequence(self.children(node.generators) + [(elt_free, set())])
+        if isinstance(node, ast.FunctionDef):
+            body_free = self.sequence(self.children(node.body))[0]
+            body_free -= self.params(node.args)
+            body_free.discard(node.name)
+            return body_free, set([node.name])
+        return self.sequence(self.children(ast.iter_child_nodes(node)))
+
+    def scope(self, node):
+        return self.memoized(self.scopes, self._scope, node)
+
+    def free_names(self, node):
+        if isinstance(node, list):
+            return self.sequence(self.children(node))[0]
+        return self.scope(node)[0]
+
+    def is_static(self, node):
+        return not self.free_names(node)
+
+    def _stored_names(self, node):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, (ast.Store, ast.Param)):
+                return set([node.id])
+            return set()
+        names = set()
+        for child in ast.iter_child_nodes(node):
+            names.update(self.stored_names(child))
+        return names
+
+    def stored_names(self, node):
+        return self.memoized(self.stores, self._stored_names, node)
+
+    def _is_safe(self, node):
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name):
+                if node.func.id not in PURE_FUNCTIONS:
+                    return False
+            elif not isinstance(node.func, ast.Attribute)\
+                    or node.func.attr not in PURE_METHODS:
+                return False
+        elif isinstance(node, (ast.Assign, ast.AugAssign)):
+            targets = getattr(node, "targets", [getattr(node, "target", None)])
+            for target in targets:
+                for item in ast.walk(target):
+                    if isinstance(item, (ast.Attribute, ast.Subscript)):
+                        return False
+        elif isinstance(node, (ast.Delete, ast.FunctionDef)):
+            return False
+        return all(self.is_safe(x) for x in ast.iter_child_nodes(node))
+
+    def is_safe(self, node):
+        # only pure calls and assignments to plain names
+        return self.memoized(self.safe, self._is_safe, node)
+
+    def _size(self, node):
+        return 1 + sum(self.size(x) for x in ast.iter_child_nodes(node))
+
+    def size(self, node):
+        if isinstance(node, list):
+            return sum(self.size(x) for x in node)
+        return self.memoized(self.sizes, self._size, node)
 
 
 class OpenReplaceOptimizer(ast.NodeTransformer):
 
+    def __init__(self):
+        self.analysis = TreeAnalysis()
+        super(OpenReplaceOptimizer, self).__init__()
+
     def evaluate(self, node):
         return eval(compile(ast.fix_missing_locations(ast.Expression(node)), '', 'eval'))
 
@@ -115,53 +210,145 @@ class OpenReplaceOptimizer(ast.NodeTransformer):
     def _quoteattr(self, data):
         return make_call(QUOTEATTR, data)
 
+    def has_static_name(self, pair):
+        return isinstance(pair, ast.Tuple) and len(pair.elts) == 2\
+            and self.analysis.is_static(pair.elts[0])
+
+    def attr_value(self, value):
+        if self.analysis.is_static(value):
+            return ast.Str(quoteattr(self.evaluate(value)))
+        return self._quoteattr(value)
+
+    def merge_attrs(self, pairs):
+        # static names are sorted and their static values quoted now, the
+        # pairs with dynamic names get merged in by a writer cached per shape
+        named = [(self.evaluate(x.elts[0]), index, x.elts[1])
+                 for index, x in enumerate(pairs) if self.has_static_name(x)]
+        named.sort(key=itemgetter(0, 1))
+        rest = [(index, x) for index, x in enumerate(pairs) if not self.has_static_name(x)]
+        return make_call(MERGE_ATTRS,
+                         ast.Tuple([scalar_to_ast(x[0]) for x in named], ast.Load()),
+                         ast.Tuple([self.attr_value(x[2]) for x in named], ast.Load()),
+                         tuple(x[1] for x in named) + tuple(x[0] for x in rest),
+                         ast.Tuple([x[1] for x in rest], ast.Load()),
+                         ast.Name(WRITE, ast.Load()))
+
     def visit_Expr(self, node):
         if isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name) and node.value.func.id == OPEN_TAG:
-            static_args = []
-            dynamic_args = []
             tagname = node.value.args[0].s
-            for pair in node.value.args[1:]:
-                pair = InterpolateStrings().visit(pair)
-                if StaticTreeVisitor.is_static(pair):
-                    static_args.append(pair)
-                else:
-                    dynamic_args.append(pair)
+            all_args = [InterpolateStrings().visit(x) for x in node.value.args[1:]]
 
             block = [self._write("<%s" % tagname)]
 
-            if not dynamic_args:
+            if all(self.analysis.is_static(x) for x in all_args):
                 static_attrs_data = []
-                write_attrs([self.evaluate(x) for x in static_args], static_attrs_data.append)
+                write_attrs([self.evaluate(x) for x in all_args], static_attrs_data.append)
                 block.append(self._write(''.join(static_attrs_data)))
             else:
-                static_names = False
-                all_args = static_args + dynamic_args
-                for arg in all_args:
-                    if not StaticTreeVisitor.is_static(arg.elts[0]):
-                        break
-                else:
-                    static_names = True
-                if static_names:
+                if all(self.has_static_name(x) for x in all_args):
                     attrs_items = []
-                    flatten_args = []
-                    for arg in all_args:
-                        value = arg.elts[1]
-                        if StaticTreeVisitor.is_static(value):
-                            value = ast.Str(str(self.evaluate(value)))
-                        else:
-                            value = self._quoteattr(value)
-                        flatten_args.append((self.evaluate(arg.elts[0]), value))
+                    flatten_args = [(self.evaluate(x.elts[0]), self.attr_value(x.elts[1]))
+                                    for x in all_args]
                     write_attrs_ast(flatten_args, attrs_items.append)
                     for item in attrs_items:
                         block.append(self._write(item))
                 else:
-                    block.append(make_expr(make_call(WRITE_ATTRS, ast.Tuple(all_args, ast.Load()), ast.Name(WRITE, ast.Load()))))
+                    block.append(make_expr(self.merge_attrs(all_args)))
 
             block.append(self._write(">\n"))
             return copy_loc(block, node)
         return node
 
 
+class LoopInvariantOptimizer(ast.NodeTransformer):
+
+    def __init__(self):
+        self.counter = 0
+        self.hoists = {}
+        self.analysis = TreeAnalysis()
+        super(LoopInvariantOptimizer, self).__init__()
+
+    def is_safe(self, body):
+        return all(self.analysis.is_safe(x) for x in body)
+
+    def is_pure(self, node, bound):
+        if isinstance(node, ast.Name):
+            return node.id not in bound
+        if isinstance(node, (ast.Str, ast.Num)):
+            return True
+        if isinstance(node, ast.Attribute):
+            return self.is_pure(node.value, bound)
+        if isinstance(node, ast.Tuple):
+            return all(self.is_pure(x, bound) for x in node.elts)
+        if isinstance(node, ast.BinOp):
+            return isinstance(node.left, ast.Str)\
+                and isinstance(node.op, ast.Mod)\
+                and self.is_pure(node.right, bound)
+        return False
+
+    def jumps(self, body):
+        # the init at the top of the body would also run on iterations
+        # leaving before the write
+        return any(isinstance(x, (ast.Break, ast.Continue))
+                   for st in body for x in ast.walk(st))
+
+    def is_reset(self, st):
+        return isinstance(st, ast.Assign)\
+            and len(st.targets) == 1\
+            and isinstance(st.targets[0], ast.Name)\
+            and st.targets[0].id in self.hoists
+
+    def invariant_write(self, st, bound):
+        if not isinstance(st, ast.Expr)\
+                or not isinstance(st.value, ast.Call)\
+                or not isinstance(st.value.func, ast.Name)\
+                or st.value.func.id != WRITE:
+            return None
+        call = st.value.args[0]
+        if isinstance(call, ast.Call)\
+                and isinstance(call.func, ast.Name)\
+                and call.func.id in (ESCAPE, QUOTEATTR, TO_STRING, NUMBER, NUMBER_ATTR)\
+                and len(call.args) == 1\
+                and self.is_pure(call.args[0], bound):
+            return call
+        return None
+
+    def visit_For(self, node):
+        # an invariant value is computed on the first iteration and kept
+        # until the loop is entered again, a loop that never runs must not
+        # evaluate what its body would have written
+        self.generic_visit(node)
+        if node.orelse or not self.is_safe(node.body) or self.jumps(node.body):
+            return node
+        bound = set(self.analysis.stored_names(node.target))
+        for st in node.body:
+            if not self.is_reset(st):
+                bound.update(self.analysis.stored_names(st))
+        resets = []
+        inits = []
+        body = []
+        for st in node.body:
+            call = self.invariant_write(st, bound)
+            if self.is_reset(st) and self.is_pure(self.hoists[st.targets[0].id].args[0], bound):
+                # hoisted by an inner loop and invariant here too
+                resets.append(st)
+            elif call:
+                count(self, "expressions_hoisted")
+                name = HOIST + str(self.counter)
+                self.counter += 1
+                self.hoists[name] = call
+                resets.append(copy_loc(ast.Assign([ast.Name(name, ast.Store())], scalar_to_ast(None)), st))
+                test = ast.Compare(ast.Name(name, ast.Load()), [ast.Is()], [scalar_to_ast(None)])
+                inits.append(copy_loc(make_cond(test, ast.Assign([ast.Name(name, ast.Store())], call)), st))
+                body.append(copy_loc(make_expr(make_call(WRITE, ast.Name(name, ast.Load()))), st))
+            else:
+                body.append(st)
+        if not resets:
+            return node
+        node.body = inits + body
+        return resets + [node]
+
+
 class MultiWriteOptimizer(ast.NodeTransformer):
 
     def is_write(self, node):
@@ -191,6 +378,7 @@ class MultiWriteOptimizer(ast.NodeTransformer):
         writes = []
         def _flush():
             if writes:
+                count(self, "writes_merged", len(writes) - 1)
                 joined = self.join_strings(writes)
                 if len(joined) > 1:
                     result.append(make_expr(make_call(WRITE_MULTI, make_tuple(*joined))))
@@ -230,158 +418,571 @@ class MultiWriteOptimizer(ast.NodeTransformer):
                         node)
 
 
-class SubstituteVisitor(ast.NodeTransformer):
+def store_counts(module):
+    # name -> how many times the tree binds it
+    stores = {}
+    for node in ast.walk(module):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            name = node.id
+        elif isinstance(node, ast.FunctionDef):
+            name = node.name
+        elif sys.version_info[0] >= 3 and isinstance(node, ast.arg):
+            name = node.arg
+        else:
+            continue
+        stores[name] = stores.get(name, 0) + 1
+    return stores
+
+
+def is_literal_value(value):
+    if isinstance(value, (list, tuple)):
+        return all(is_literal_value(x) for x in value)
+    if isinstance(value, dict):
+        return all(is_literal_value(x) for x in value.keys())\
+            and all(is_literal_value(x) for x in value.values())
+    return type(value) in CONSTANT_TYPES
+
+
+def specialize(node, static_context):
+    # names of the static context the template never binds itself turn
+    # into literals, the rest of the optimizer takes it from there
+    for name, value in static_context.items():
+        if not is_literal_value(value):
+            raise TypeError("static context value of %s isn't made of literals: %r" % (name, value))
+    stores = store_counts(node)
+    names = dict((name, scalar_to_ast(value)) for name, value in static_context.items()
+                 if name not in stores)
+    if names:
+        node.body = [SubstituteVisitor(names).visit(x) for x in node.body]
+    return node
+
+
+def visit_block(visitor, body):
+    result = []
+    for st in body:
+        st = visitor.visit(st)
+        if isinstance(st, list):
+            result.extend(st)
+        elif st is not None:
+            result.append(st)
+    return result
+
+
+class CopyVisitor(ast.NodeTransformer):
 
-    def __init__(self, name, replacement):
-        self.name = name
-        self.replacement = replacement
+    def generic_visit(self, node):
+        copied = node.__class__()
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                value = [self.visit(x) if isinstance(x, ast.AST) else x for x in value]
+            elif isinstance(value, ast.AST) and not isinstance(value, ast.expr_context):
+                value = self.visit(value)
+            setattr(copied, field, value)
+        for attr in node._attributes:
+            if hasattr(node, attr):
+                setattr(copied, attr, getattr(node, attr))
+        return copied
+
+
+class SubstituteVisitor(CopyVisitor):
+    # copies the tree it visits, so one loop or function body can be
+    # expanded any number of times without deepcopying it first
+
+    def __init__(self, names):
+        self.names = names
 
     def visit_Name(self, node):
-        if node.id == self.name and isinstance(node.ctx, ast.Load):
-            return self.replacement
+        if node.id in self.names and isinstance(node.ctx, ast.Load):
+            return CopyVisitor().visit(self.names[node.id])
+        return self.generic_visit(node)
+
+
+class FoldLimit(Exception):
+
+    pass
+
+
+class TripCounter(object):
+    # shared by every loop of one compile time evaluation
+
+    def __init__(self, limit=FOLD_TRIPS):
+        self.left = limit
+
+    def __call__(self, iterable):
+        for item in iterable:
+            self.left -= 1
+            if self.left < 0:
+                raise FoldLimit()
+            yield item
+
+
+class CountTrips(CopyVisitor):
+    # a copy whose loops and comprehensions run through TRIPS
+
+    def visit_For(self, node):
+        node = self.generic_visit(node)
+        node.iter = make_call(TRIPS, node.iter)
         return node
 
+    def visit_comprehension(self, node):
+        node = self.generic_visit(node)
+        node.iter = make_call(TRIPS, node.iter)
+        return node
+
+
+def compile_time_globals():
+    # range is lazy here, trip counts are taken without building the list
+    return {"range": lazy_range, "xrange": lazy_range, TRIPS: TripCounter()}
+
 
 class UnloopOptimizer(ast.NodeTransformer):
 
     def __init__(self):
-        self._unloop = False
+        self.budget = UNROLL_BUDGET
+        self.analysis = TreeAnalysis()
         super(UnloopOptimizer, self).__init__()
 
     def evaluate(self, node):
-        return eval(compile(ast.fix_missing_locations(ast.Expression(node)), '', 'eval'))
+        expression = ast.Expression(CountTrips().visit(node))
+        return eval(compile(ast.fix_missing_locations(expression), '', 'eval'), compile_time_globals())
+
+    def is_unpackable(self, target):
+        if isinstance(target, ast.Name):
+            return True
+        if isinstance(target, (ast.Tuple, ast.List)):
+            return all(self.is_unpackable(x) for x in target.elts)
+        return False
+
+    def unpack(self, target, value, scope):
+        if isinstance(target, ast.Name):
+            scope[target.id] = value
+            return
+        values = list(value)
+        if len(values) != len(target.elts):
+            raise ValueError("can't unpack %r into %i names" % (value, len(target.elts)))
+        for item, value in zip(target.elts, values):
+            self.unpack(item, value, scope)
+
+    def fold(self, node, names):
+        if self.analysis.free_names(node.body) - names or node.orelse:
+            return None
+        for item in ast.walk(ast.Module(node.body)):
+            if isinstance(item, ast.While):
+                return None
+        parts = []
+        size = [0]
+        def _write(data):
+            size[0] += len(data)
+            if size[0] > FOLD_LIMIT:
+                raise FoldLimit()
+            parts.append(data)
+        globs = compile_time_globals()
+        globs.update({
+            WRITE: _write,
+            ESCAPE: escape,
+            QUOTEATTR: quoteattr,
+            TO_STRING: soft_unicode,
+            WRITE_ATTRS: write_attrs,
+            MERGE_ATTRS: write_merged_attrs,
+            NUMBER: number,
+            NUMBER_ATTR: number_attr,
+        })
+        loop = CountTrips().visit(ast.Module([ast.For(node.target, node.iter, node.body, [])]))
+        scope = {}
+        try:
+            exec_(compile(ast.fix_missing_locations(loop), '', 'exec'), globs, scope)
+        except Exception:
+            return None
+        # names the loop leaves bound keep their last value
+        block = []
+        for name, value in sorted(scope.items()):
+            if type(value) not in CONSTANT_TYPES:
+                return None
+            block.append(ast.Assign([ast.Name(name, ast.Store())], scalar_to_ast(value)))
+        if parts:
+            block.insert(0, make_expr(make_call(WRITE, "".join(parts))))
+        count(self, "loops_folded")
+        return copy_loc(block, node)
 
     def visit_For(self, node):
-        if StaticTreeVisitor.is_static(node.iter):
-            names = NameExtractorVisitor.extract_names(node.target)
-            iterable = self.evaluate(node.iter)
-            block = []
-            for value in self.evaluate(node.iter):
-                iter_assign = ast.Assign([node.target], scalar_to_ast(value))
-                code = compile(ast.fix_missing_locations(ast.Module([iter_assign])), '', 'exec')
-                scope = {}
-                body = [copy.deepcopy(x) for x in node.body]
-                exec_(code, {}, scope)
-                for st in body:
-                    for name in names:
-                        st = SubstituteVisitor(name, scalar_to_ast(scope[name])).visit(st)
-                    block.append(st)
-            self._unloop = True
-            return block
-        return node
+        if not self.analysis.is_static(node.iter) or not self.is_unpackable(node.target):
+            return node
+        for item in ast.walk(ast.Module(node.body)):
+            if isinstance(item, (ast.Break, ast.Continue)):
+                return node
+        body_size = max(self.analysis.size(node.body), 1)
+        trips = max(self.budget, 0) // body_size
+        try:
+            values = list(islice(self.evaluate(node.iter), trips + 1))
+        except Exception:
+            return node
+        if len(values) > trips:
+            count(self, "loops_over_budget")
+            folded = self.fold(node, self.analysis.stored_names(node.target))
+            if folded is None:
+                return node
+            return folded
+        self.budget -= len(values) * body_size
+        block = []
+        for value in values:
+            scope = {}
+            self.unpack(node.target, value, scope)
+            names = dict((name, scalar_to_ast(x)) for name, x in scope.items())
+            block.extend(SubstituteVisitor(names).visit(x) for x in node.body)
+        block.extend(node.orelse)
+        count(self, "loops_unrolled")
+        # copies are visited right away instead of in another pass over
+        # the whole module, loops nested in them may just have become static
+        return visit_block(self, block)
+
+
+class ConstantFoldOptimizer(ast.NodeTransformer):
+    # evaluates static expressions and keeps only the taken branch of
+    # static ifs; a name assigned once from a constant is that constant
+    # in the statements after the assignment
+
+    FOLDABLE = (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Subscript)
+    HELPERS = {ESCAPE: escape, QUOTEATTR: quoteattr, TO_STRING: soft_unicode,
+               NUMBER: number, NUMBER_ATTR: number_attr}
 
-    def perform(self, node):
-        result = self.visit(node)
-        if self._unloop:
-            return UnloopOptimizer().perform(result)
-        return result
+    def evaluate(self, node):
+        return eval(compile(ast.fix_missing_locations(ast.Expression(node)), '', 'eval'), dict(self.HELPERS))
+
+    def is_foldable(self, node):
+        if isinstance(node, ast.Call):
+            return isinstance(node.func, ast.Name) and node.func.id in self.HELPERS\
+                and not node.keywords and not node.starargs and not node.kwargs
+        if isinstance(node, ast.BinOp):
+            # no huge numbers or strings
+            return not isinstance(node.op, (ast.Pow, ast.LShift, ast.Mult))\
+                or isinstance(node.op, ast.Mult) and isinstance(node.left, ast.Num) and isinstance(node.right, ast.Num)
+        if isinstance(node, ast.Subscript):
+            return isinstance(node.ctx, ast.Load) and not isinstance(node.slice, ast.ExtSlice)
+        return isinstance(node, self.FOLDABLE)
+
+    def operands(self, node):
+        if isinstance(node, ast.Call):
+            return node.args
+        if isinstance(node, ast.Subscript):
+            index = node.slice
+            if isinstance(index, ast.Index):
+                index = index.value
+            if isinstance(index, ast.Slice):
+                return [node.value] + [x for x in (index.lower, index.upper, index.step) if x]
+            return [node.value, index]
+        return [x for x in ast.iter_child_nodes(node) if isinstance(x, ast.expr)]
+
+    def is_constant(self, node):
+        if isinstance(node, (ast.Tuple, ast.List)):
+            return all(self.is_constant(x) for x in node.elts)
+        if isinstance(node, ast.Dict):
+            return all(self.is_constant(x) for x in node.keys + node.values)
+        return self.is_literal(node)
 
+    def generic_visit(self, node):
+        # children are folded first, so a static expression is left with
+        # nothing but literals below it
+        node = super(ConstantFoldOptimizer, self).generic_visit(node)
+        if isinstance(node, ast.IfExp) and self.is_literal(node.test):
+            count(self, "branches_removed")
+            return node.body if self.evaluate(node.test) else node.orelse
+        if isinstance(node, ast.expr):
+            if self.is_foldable(node) and all(self.is_constant(x) for x in self.operands(node)):
+                return self.fold(node)
+        elif isinstance(node, ast.stmt) and getattr(node, "body", None) == []:
+            node.body = [copy_loc(ast.Pass(), node)]
+        return node
 
+    def fold(self, node):
+        try:
+            value = self.evaluate(node)
+        except Exception:
+            return node
+        if type(value) not in CONSTANT_TYPES:
+            return node
+        count(self, "escapes_folded" if isinstance(node, ast.Call) else "constants_folded")
+        return copy_loc(scalar_to_ast(value), node)
 
-class StaticEscapeOptimizer(ast.NodeTransformer):
+    def is_literal(self, node):
+        if isinstance(node, ast.Name):
+            return node.id in ("True", "False", "None")
+        return isinstance(node, (ast.Str, ast.Num))
 
-    def evaluate(self, node):
-        return eval(compile(ast.fix_missing_locations(ast.Expression(node)), '', 'eval'))
+    def visit_If(self, node):
+        node.test = self.visit(node.test)
+        if not self.is_literal(node.test):
+            return self.generic_visit(node)
+        count(self, "branches_removed")
+        return visit_block(self, node.body if self.evaluate(node.test) else node.orelse)
 
-    def visit_Call(self, node):
-        if isinstance(node.func, ast.Name) and node.func.id == WRITE:
-            call = node.args[0]
-            if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id in (ESCAPE, QUOTEATTR):
-                if StaticTreeVisitor.is_static(call.args[0]):
-                    if call.func.id == ESCAPE:
-                        node = make_call(WRITE, ast.Str(escape(self.evaluate(call.args[0]))))
-                    elif call.func.id == QUOTEATTR:
-                        node = make_call(WRITE, ast.Str(quoteattr(self.evaluate(call.args[0]))))
-        return node
+    def uses(self, node, names):
+        return any(isinstance(x, ast.Name) and x.id in names for x in ast.walk(node))
 
+    def visit_Module(self, node):
+        once = None
+        constants = {}
+        body = []
+        for st in node.body:
+            if constants and self.uses(st, constants):
+                st = SubstituteVisitor(constants).visit(st)
+            body.extend(visit_block(self, [st]))
+            st = body[-1] if body else None
+            if isinstance(st, ast.Assign) and len(st.targets) == 1\
+                    and isinstance(st.targets[0], ast.Name) and self.is_literal(st.value):
+                if once is None:
+                    once = set(name for name, number in store_counts(node).items() if number == 1)
+                if st.targets[0].id in once:
+                    count(self, "names_propagated")
+                    constants[st.targets[0].id] = st.value
+        node.body = body
+        return node
 
 
 class InlineOptimizer(ast.NodeTransformer):
 
     def __init__(self):
-        self.functions = [[]]
-        self._inline = False
+        self.functions = [{}]
+        self.inlining = []
         super(InlineOptimizer, self).__init__()
 
+    def lookup(self, name):
+        for scope in reversed(self.functions):
+            if name in scope:
+                return scope[name]
+        return None
+
     def visit_Expr(self, node):
         if not isinstance(node.value, ast.Call):
             return node
         if isinstance(node.value.func, ast.Name)\
                     and node.value.func.id not in (WRITE, WRITE_MULTI, ESCAPE, QUOTEATTR)\
+                    and node.value.func.id not in self.inlining\
                     and not node.value.keywords\
                     and not node.value.starargs\
                     and not node.value.kwargs:
-            impl = None
-            for name, impl in sum(reversed(self.functions), []):
-                if name == node.value.func.id:
-                    break
-            else:
-                return node
+            impl = self.lookup(node.value.func.id)
             if not impl or impl.args.vararg or impl.args.kwarg:
                 return node
-            undefined = object()
             min_args = len(impl.args.args) - len(impl.args.defaults)
             max_args = len(impl.args.args)
             if len(node.value.args) < min_args or len(node.value.args) > max_args:
                 return node
-            body = copy.deepcopy(impl.body)
             values = node.value.args[:]
             values += impl.args.defaults[len(values) - max_args:]
-            for arg, value in zip(impl.args.args, values):
-                body = [SubstituteVisitor(arg.id, value).visit(x) for x in body]
-            self._inline = True
+            substitute = SubstituteVisitor(dict(zip([arg_name(x) for x in impl.args.args], values)))
+            count(self, "functions_inlined")
+            # the inlined body is expanded further right here, the stack
+            # of functions being inlined stops recursive macros
+            self.inlining.append(impl.name)
+            body = visit_block(self, [substitute.visit(x) for x in impl.body])
+            self.inlining.pop()
             return body
         return node
 
     def visit_FunctionDef(self, node):
-        if not defines_functions(node.body):
-            self.functions[-1].append((node.name, node))
-        self.functions.append([])
-        new_body = []
-        for child in node.body:
-            result = self.visit(child)
-            if isinstance(result, list):
-                new_body.extend(result)
-            else:
-                new_body.append(result)
-        node.body = new_body
+        if defines_functions(node.body):
+            self.functions[-1][node.name] = None
+        else:
+            self.functions[-1][node.name] = node
+        self.functions.append({})
+        self.inlining.append(node.name)
+        node.body = visit_block(self, node.body)
+        self.inlining.pop()
         self.functions.pop()
         return node
 
-    def perform(self, node):
-        result = self.visit(node)
-        if self._inline:
-            return InlineOptimizer().perform(result)
-        return result
+
+def parse_hint(text):
+    # "list[dict[str, int]]" -> ("list", ("dict", "str", "int"))
+    def convert(node):
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+            index = node.slice.value if isinstance(node.slice, ast.Index) else node.slice
+            args = index.elts if isinstance(index, ast.Tuple) else [index]
+            return (node.value.id, ) + tuple(convert(x) for x in args)
+        raise RuntimeError("bad context hint %r" % text)
+    try:
+        return convert(ast.parse(text.strip(), mode="eval").body)
+    except SyntaxError:
+        raise RuntimeError("bad context hint %r" % text)
+
+
+class TypeHintOptimizer(ast.NodeTransformer):
+    # follows the types context hints give through loops, subscripts and
+    # assignments; numbers are stringified instead of escaped. the helpers
+    # check the type, so a wrong guess only costs the escaping it saved
+
+    def __init__(self):
+        self.hints = {}
+        self.types = {}
+        super(TypeHintOptimizer, self).__init__()
+
+    def element(self, hint):
+        if isinstance(hint, tuple) and hint[0] in ("list", "set", "dict", "tuple") and len(hint) > 1:
+            return hint[1]
+        return None
+
+    def type_of(self, node):
+        if isinstance(node, ast.Name):
+            return self.types.get(node.id)
+        if isinstance(node, ast.Num):
+            return type(node.n).__name__
+        if isinstance(node, ast.Subscript):
+            hint = self.type_of(node.value)
+            if not isinstance(hint, tuple) or len(hint) < 2:
+                return None
+            if hint[0] == "dict" and len(hint) == 3:
+                return hint[2]
+            if hint[0] == "list" and not isinstance(node.slice, ast.Slice):
+                return hint[1]
+            return None
+        if isinstance(node, ast.Call):
+            return self.call_type(node)
+        if isinstance(node, ast.BinOp):
+            left, right = self.type_of(node.left), self.type_of(node.right)
+            if left in NUMBER_HINTS and right in NUMBER_HINTS:
+                return "float" if "float" in (left, right) else "int"
+        if isinstance(node, ast.Compare):
+            return "bool"
+        return None
+
+    def call_type(self, node):
+        if isinstance(node.func, ast.Name):
+            name = node.func.id
+            if name == "len":
+                return "int"
+            if name in ("range", "xrange"):
+                return ("list", "int")
+            if name == "enumerate" and node.args:
+                return ("list", ("tuple", "int", self.element(self.type_of(node.args[0]))))
+            if name in NUMBER_HINTS:
+                return name
+        elif isinstance(node.func, ast.Attribute):
+            hint = self.type_of(node.func.value)
+            if isinstance(hint, tuple) and hint[0] == "dict" and len(hint) == 3:
+                return {
+                    "keys": ("list", hint[1]),
+                    "values": ("list", hint[2]),
+                    "items": ("list", ("tuple", hint[1], hint[2])),
+                    "iterkeys": ("list", hint[1]),
+                    "itervalues": ("list", hint[2]),
+                    "iteritems": ("list", ("tuple", hint[1], hint[2])),
+                    "get": hint[2],
+                }.get(node.func.attr)
+        return None
+
+    def bind(self, target, hint):
+        if isinstance(target, ast.Name):
+            if hint is None:
+                self.types.pop(target.id, None)
+            else:
+                self.types[target.id] = hint
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            if isinstance(hint, tuple) and hint[0] == "tuple" and len(hint) == len(target.elts) + 1:
+                for item, item_hint in zip(target.elts, hint[1:]):
+                    self.bind(item, item_hint)
+            else:
+                for item in target.elts:
+                    self.bind(item, None)
+
+    def forget(self, nodes):
+        for node in nodes:
+            for item in ast.walk(node):
+                if isinstance(item, ast.Name) and not isinstance(item.ctx, ast.Load):
+                    self.types.pop(item.id, None)
+
+    def visit_Module(self, node):
+        self.types = dict((name, parse_hint(hint)) for name, hint in self.hints.items())
+        if self.types:
+            self.generic_visit(node)
+        return node
+
+    def visit_Assign(self, node):
+        node.value = self.visit(node.value)
+        hint = self.type_of(node.value)
+        for target in node.targets:
+            self.bind(target, hint)
+        return node
+
+    def visit_For(self, node):
+        node.iter = self.visit(node.iter)
+        hint = self.element(self.type_of(node.iter))
+        # a later iteration may see what the body assigns
+        self.forget(node.body)
+        self.bind(node.target, hint)
+        node.body = visit_block(self, node.body)
+        node.orelse = visit_block(self, node.orelse)
+        return node
+
+    def visit_comprehension(self, node):
+        node.iter = self.visit(node.iter)
+        self.bind(node.target, self.element(self.type_of(node.iter)))
+        node.ifs = [self.visit(x) for x in node.ifs]
+        return node
+
+    def visit_ListComp(self, node):
+        node.generators = [self.visit(x) for x in node.generators]
+        node.elt = self.visit(node.elt)
+        return node
+
+    def visit_FunctionDef(self, node):
+        saved = self.types
+        self.types = dict(saved)
+        for arg in node.args.args:
+            self.types.pop(arg_name(arg), None)
+        for name in (node.args.vararg, node.args.kwarg):
+            if name is not None:
+                self.types.pop(arg_name(name) if isinstance(name, ast.AST) else name, None)
+        self.forget(node.body)
+        node.body = visit_block(self, node.body)
+        self.types = saved
+        return node
+
+    def visit_If(self, node):
+        node.test = self.visit(node.test)
+        self.forget(node.body + node.orelse)
+        node.body = visit_block(self, node.body)
+        node.orelse = visit_block(self, node.orelse)
+        return node
+
+    visit_While = visit_If
+
+    def generic_visit(self, node):
+        node = super(TypeHintOptimizer, self).generic_visit(node)
+        if isinstance(node, ast.stmt) and not isinstance(node, ast.Expr):
+            # with, except, augmented assignments...
+            self.forget([node])
+        return node
+
+    def visit_Call(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in (ESCAPE, QUOTEATTR)\
+                and len(node.args) == 1 and self.type_of(node.args[0]) in NUMBER_HINTS:
+            count(self, "escapes_skipped")
+            name = NUMBER if node.func.id == ESCAPE else NUMBER_ATTR
+            return copy_loc(make_call(name, node.args[0]), node)
+        return node
+
 
 class DeadDefinesOptimizer(ast.NodeTransformer):
 
+    def __init__(self):
+        self.analysis = TreeAnalysis()
+        super(DeadDefinesOptimizer, self).__init__()
+
     def remove_dead_defines(self, body):
-        functions = []
-        keep = []
-        for item in body:
-            if isinstance(item, ast.FunctionDef):
-                functions.append(item.name)
+        functions = set(x.name for x in body if isinstance(x, ast.FunctionDef))
+        keep = set()
         for item in body:
-            names = NameCollectorVisitor()
-            names.visit(item)
-            for name in names.names:
-                if name in functions and name not in keep:
-                    keep.append(name)
-        new_body = []
-        for item in body:
-            if isinstance(item, ast.FunctionDef):
-                if item.name in keep:
-                    new_body.append(item)
-            else:
-                new_body.append(item)
+            keep.update(self.analysis.free_names(item) & functions)
+        new_body = [x for x in body if not isinstance(x, ast.FunctionDef) or x.name in keep]
+        count(self, "defines_removed", len(body) - len(new_body))
         return new_body
 
     def generic_visit(self, node):
         if hasattr(node, "body"):
-            node_ = copy.deepcopy(node)
-            node_.body = self.remove_dead_defines(node.body)
-            return node_
+            node.body = self.remove_dead_defines(node.body)
         return node
 
 
@@ -414,37 +1015,255 @@ class InterpolateOutput(ast.NodeTransformer):
 class UnicodifyStrings(ast.NodeTransformer):
 
     def visit_Str(self, node):
-        return copy_loc(ast.Str(soft_unicode(node.s)), node)
+        node.s = soft_unicode(node.s)
+        return node
+
+
+class EscapingNamesVisitor(ast.NodeVisitor):
+
+    def __init__(self):
+        self.names = set()
+        self.bound = []
+        super(EscapingNamesVisitor, self).__init__()
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self.bound.append(NameExtractorVisitor.extract_names(node.target))
+        for child in node.body:
+            self.visit(child)
+        self.bound.pop()
+        for child in node.orelse:
+            self.visit(child)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            for bound in self.bound:
+                if node.id in bound:
+                    break
+            else:
+                self.names.add(node.id)
+
+
+class LoopWriteOptimizer(MultiWriteOptimizer):
+
+    def __init__(self):
+        self.escaping = set()
+        self.joins = {}
+        self.streaming = False
+        self.depth = 0
+        super(LoopWriteOptimizer, self).__init__()
+
+    def make_join(self, comp):
+        join = ast.Call(ast.Attribute(ast.Str(soft_unicode("")), "join", ast.Load()),
+                        [comp], [], None, None)
+        self.joins[id(join)] = join
+        return join
+
+    def elements(self, node):
+        if not isinstance(node, ast.Expr)\
+                or not isinstance(node.value, ast.Call)\
+                or not isinstance(node.value.func, ast.Name):
+            return None
+        if node.value.func.id == WRITE:
+            return node.value.args[:1]
+        if node.value.func.id == WRITE_MULTI:
+            data = node.value.args[0]
+            if isinstance(data, ast.Tuple):
+                return data.elts
+            if isinstance(data, ast.ListComp):
+                return [self.make_join(data)]
+        return None
+
+    def concat(self, elements):
+        result = elements[0]
+        for item in elements[1:]:
+            result = ast.BinOp(result, ast.Add(), item)
+        return result
+
+    def lower(self, node):
+        if node.orelse:
+            return node
+        elements = []
+        for item in node.body:
+            parts = self.elements(item)
+            if parts is None:
+                return node
+            elements.extend(parts)
+        for item in elements:
+            if id(item) in self.joins:
+                return node
+        for name in NameExtractorVisitor.extract_names(node.target):
+            if name in self.escaping:
+                return node
+        count(self, "loops_lowered")
+        comp = ast.ListComp(self.concat(self.join_strings(elements)),
+                            [ast.comprehension(node.target, node.iter, [])])
+        return copy_loc(make_expr(make_call(WRITE_MULTI, comp)), node)
+
+    def optimize_writes(self, body):
+        result = []
+        run = []
+        def _flush():
+            if len(run) > 1:
+                count(self, "writes_merged", len(run) - 1)
+                elements = sum([self.elements(x) for x in run], [])
+                joined = self.join_strings(elements)
+                result.append(copy_loc(make_expr(make_call(WRITE_MULTI, make_tuple(*joined))), run[0]))
+            else:
+                result.extend(run)
+            run[:] = []
+
+        for item in body:
+            item = self.visit(item)
+            if self.elements(item) is not None:
+                run.append(item)
+            else:
+                _flush()
+                result.append(item)
+        _flush()
+        return result
+
+    def visit_For(self, node):
+        self.depth += 1
+        node = super(LoopWriteOptimizer, self).visit_For(node)
+        self.depth -= 1
+        # streaming renders flush at the end of loop iterations, the
+        # outermost loop has to stay a loop there
+        if self.streaming and not self.depth:
+            return node
+        return self.lower(node)
+
+    def visit_FunctionDef(self, node):
+        # nothing is flushed inside defs
+        depth, self.depth = self.depth, 1
+        node = super(LoopWriteOptimizer, self).visit_FunctionDef(node)
+        self.depth = depth
+        return node
+
+    def perform(self, node):
+        escaping = EscapingNamesVisitor()
+        escaping.visit(node)
+        self.escaping = escaping.names
+        return self.visit(node)
+
+
+class FormatWriteOptimizer(ast.NodeTransformer):
+    # f-strings only, `%` formatting measured slower than a tuple of parts
+    # on python 2.7 for any mix of static and dynamic parts
+
+    def element(self, node):
+        if is_join(node):
+            node.args = [self.format_comp(node.args[0])]
+        return node
+
+    def operands(self, node):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self.operands(node.left) + self.operands(node.right)
+        return [self.element(node)]
+
+    def format(self, elements):
+        return ast.JoinedStr([item if isinstance(item, ast.Str)
+                              else ast.FormattedValue(item, -1, None)
+                              for item in elements])
+
+    def format_comp(self, comp):
+        elements = self.operands(comp.elt)
+        if len(elements) > 1:
+            comp.elt = self.format(elements)
+        return comp
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and node.func.id == WRITE_MULTI:
+            data = node.args[0]
+            if isinstance(data, ast.Tuple):
+                elements = [self.element(x) for x in data.elts]
+                return copy_loc(make_call(WRITE, self.format(elements)), node)
+            if isinstance(data, ast.ListComp):
+                node.args = [self.format_comp(data)]
+        return node
 
 
 OPTIMIZATION_PIPELINE = (
     InterpolateOutput,
+    ConstantFoldOptimizer,
     OpenReplaceOptimizer,
     UnloopOptimizer,
     InlineOptimizer,
     DeadDefinesOptimizer,
-    StaticEscapeOptimizer,
+    TypeHintOptimizer,
+    ConstantFoldOptimizer,
     UnicodifyStrings,
+    LoopInvariantOptimizer,
     MultiWriteOptimizer,
+    LoopWriteOptimizer,
 )
 
 
-def optimize(node):
-    for optimizer_cls in OPTIMIZATION_PIPELINE:
+def optimize(node, format_writes=False, unroll_budget=UNROLL_BUDGET, stats=None, static_context=None,
+             type_hints=None, streaming=False):
+    pipeline = OPTIMIZATION_PIPELINE
+    if static_context:
+        node = specialize(node, static_context)
+    if format_writes and hasattr(ast, "JoinedStr"):
+        pipeline += (FormatWriteOptimizer, )
+    if stats is not None:
+        stats["passes"] = []
+        stats["counters"] = {}
+        stats["nodes_before"] = count_nodes(node)
+    for optimizer_cls in pipeline:
         optimizer = optimizer_cls()
+        if isinstance(optimizer, UnloopOptimizer):
+            optimizer.budget = unroll_budget
+        if isinstance(optimizer, TypeHintOptimizer):
+            optimizer.hints = type_hints or {}
+        if isinstance(optimizer, LoopWriteOptimizer):
+            optimizer.streaming = streaming
+        if stats is not None:
+            nodes_before = count_nodes(node)
+            started = default_timer()
         if hasattr(optimizer, "perform"):
             node = optimizer.perform(node)
         else:
             node = optimizer.visit(node)
-    
-    names = NameCollectorVisitor()
-    names.visit(node)
-    names = list(set(names.names))
+        if stats is not None:
+            counters = getattr(optimizer, "counters", {})
+            stats["passes"].append({
+                "name": optimizer_cls.__name__,
+                "time": default_timer() - started,
+                "iterations": getattr(optimizer, "iterations", 1),
+                "nodes_before": nodes_before,
+                "nodes_after": count_nodes(node),
+                "counters": counters,
+            })
+            for event, total in counters.items():
+                stats["counters"][event] = stats["counters"].get(event, 0) + total
+    if stats is not None:
+        stats["time"] = sum(x["time"] for x in stats["passes"])
+        stats["nodes_after"] = count_nodes(node)
+
+    names = sorted(TreeAnalysis().free_names(node) - set(HELPERS))
+    # static names the template binds itself still come in as arguments,
+    # with their static value as default
+    bound = [x for x in names if x in (static_context or ())]
+    names = [x for x in names if x not in bound]
     names.extend((WRITE, WRITE_MULTI))
     if sys.version_info[0] < 3:
-        arguments = ast.arguments(args=[ast.Name(name, ast.Param()) for name in names], vararg=None,
+        arguments = ast.arguments(args=[make_arg(name) for name in names], vararg=None,
                                   kwarg="__kw", defaults=[])
     else:
-        arguments = ast.arguments([ast.arg(name, None) for name in names],
+        arguments = ast.arguments([make_arg(name) for name in names],
                                   None, None, [], '__kw', None, [], [])
-    return ast.Module([ast.FunctionDef(name=MAIN, args=arguments, body=node.body, decorator_list=[])])
+    main = ast.FunctionDef(name=MAIN, args=arguments, body=node.body or [ast.Pass()], decorator_list=[])
+    for name in bound:
+        add_arg(main, name, scalar_to_ast(static_context[name]))
+    return bind_helpers(ast.Module([main]))
+
+
+def bind_helpers(module):
+    main = module.body[0]
+    bound = [arg_name(x) for x in main.args.args]
+    used = set(x.id for x in ast.walk(main) if isinstance(x, ast.Name))
+    for name in HELPERS:
+        if name in used and name not in bound:
+            add_arg(main, name, ast.Name(name, ast.Load()))
+    return module
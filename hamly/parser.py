@@ -29,6 +29,15 @@ class ControlNode(Node):
         self.orelse = []
 
 
+class CacheNode(ControlNode):
+
+    def __init__(self, key):
+        ControlNode.__init__(self, "cache %s:" % key)
+        self.key = key
+        # set by the include resolver to "filename:line"
+        self.block = None
+
+
 class TextNode(Node):
 
     def __init__(self, text):
@@ -37,8 +46,9 @@ class TextNode(Node):
 
 class OutputNode(Node):
 
-    def __init__(self, expr):
+    def __init__(self, expr, hint=None):
         self.expr = expr
+        self.hint = hint
 
 
 class StatementNode(Node):
@@ -47,105 +57,101 @@ class StatementNode(Node):
         self.st = st
 
 
-def parse_lines(source):
-    lines = []
-    for index, data in enumerate(source.split("\n")):
-        if not data.strip() or data.strip().startswith("/"):
-            continue
-        indent = len(data) - len(data.lstrip())
-        if indent % 2:
-            raise IndentationError("bad indent on line %s" % (index + 1))
-        indent = indent / 2
-        line = Line(index + 1, indent, data.strip(), [])
-        lines.append(line)
-    return lines
+class ContextNode(Node):
 
+    def __init__(self, hints):
+        self.hints = hints
 
-def make_tree(lines):
-    levels = {}
-    roots = []
-    for line in lines:
-        if line.indent:
-            levels[line.indent - 1].children.append(line)
-        else:
-            roots.append(line)
-        levels[line.indent] = line
-    return roots
 
+class IncludeNode(Node):
 
-def linetree_to_nodetree(lines):
-    nodes = []
-    for line in lines:
-        node = line_to_node(line)
-        if line.children:
-            if not hasattr(node, "children"):
-                raise RuntimeError("bad nesting near line %s" % line.num)
-            node.children.extend(linetree_to_nodetree(line.children))
-        nodes.append(node)
-    return nodes
+    def __init__(self, path):
+        self.path = path
+
+
+class ImportNode(Node):
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = names
+
+
+TAG_HEAD = re.compile(r'(?:[%.#]\w+)*')
+
+TAG_WORD = re.compile(r'([%.#])(\w+)')
+
+INCLUDE = re.compile(r'''^include\s+(["'])(.+?)\1$''')
+
+IMPORT = re.compile(r'''^from\s+(["'])(.+?)\1\s+import\s+(\w+(?:\s*,\s*\w+)*)$''')
+
+CONTEXT = re.compile(r'^#\s*context\s+(.+)$')
+
+OUTPUT_HINT = re.compile(r'^(.+?)\s*#:\s*([\w\[\], ]+)$')
+
+CACHE = re.compile(r'^cache\s+(.+?):?$')
+
+BRACKETS = {
+    "(": re.compile(r'[()]'),
+    "{": re.compile(r'[{}]'),
+}
 
 
 def line_to_node(line):
-    def _node():
-        if line.content[0] in ".%#":
-            return line_to_tag(line)
-        elif line.content[0] == "-":
-            return line_to_control(line)
-        elif line.content[0] == "=":
-            return line_to_output(line)
-        elif line.content[0] == "+":
-            return line_to_statement(line)
-        else:
-            return line_to_text(line)
-    node = _node()
+    first = line.content[0]
+    if first in ".%#":
+        node = line_to_tag(line)
+    elif first == "-":
+        node = line_to_control(line)
+    elif first == "=":
+        node = line_to_output(line)
+    elif first == "+":
+        node = line_to_statement(line)
+    else:
+        node = line_to_text(line)
     node.line = line
     return node
 
 
+def closing_bracket(line, data, pos):
+    opening = data[pos]
+    depth = 0
+    for match in BRACKETS[opening].finditer(data, pos):
+        if match.group() == opening:
+            depth += 1
+        else:
+            depth -= 1
+            if not depth:
+                return match.start()
+    raise RuntimeError("unbalanced %s near line %s" % (opening, line.num))
+
+
 def line_to_tag(line):
     data = line.content
     attrs = {}
+    classes = []
     tagname = "div"
-    while data and data[0] in "%.#":
-        word = re.match(r'^\w+', data[1:]).group()
-        if data[0] == "%":
+    pos = TAG_HEAD.match(data).end()
+    if data[pos:pos + 1] in ("%", ".", "#"):
+        raise RuntimeError("bad tag near line %s" % line.num)
+    for prefix, word in TAG_WORD.findall(data, 0, pos):
+        if prefix == "%":
             tagname = word
-        elif data[0] == ".":
-            classname = attrs.get("class", None)
-            if classname:
-                classname += " " + word
-            else:
-                classname = word
-            attrs["class"] = classname
-        elif data[0] == "#":
+        elif prefix == ".":
+            classes.append(word)
+        else:
             attrs["id"] = word
-        data = data[len(word) + 1:]
+    if classes:
+        attrs["class"] = " ".join(classes)
     dynamic_attrs = None
-    if data and data[0] == "(":
-        open_braces = 0
-        for idx in range(len(data)):
-            if data[idx] == "(":
-                open_braces += 1
-            elif data[idx] == ")":
-                open_braces -= 1
-            if open_braces is 0:
-                break
-        assert open_braces is 0
-        dynamic_attrs = data[1:idx]
-        data = data[idx + 1:]
-    if data and data[0] == "{":
-        open_braces = 0
-        for idx in range(len(data)):
-            if data[idx] == "{":
-                open_braces += 1
-            elif data[idx] == "}":
-                open_braces -= 1
-            if open_braces is 0:
-                break
-        assert open_braces is 0
-        dynamic_attrs = "**{%s}" % data[1:idx]    
-        data = data[idx + 1:]
-    data = data.strip()
+    if data[pos:pos + 1] == "(":
+        end = closing_bracket(line, data, pos)
+        dynamic_attrs = data[pos + 1:end]
+        pos = end + 1
+    if data[pos:pos + 1] == "{":
+        end = closing_bracket(line, data, pos)
+        dynamic_attrs = "**{%s}" % data[pos + 1:end]
+        pos = end + 1
+    data = data[pos:].strip()
     node = TagNode(tagname, attrs, dynamic_attrs)
     if data:
         node.children.append(line_to_node(Line(0, 0, data, None)))
@@ -154,13 +160,51 @@ def line_to_tag(line):
 
 def line_to_control(line):
     code = line.content[1:].strip()
+    match = INCLUDE.match(code)
+    if match:
+        return IncludeNode(match.group(2))
+    match = IMPORT.match(code)
+    if match:
+        return ImportNode(match.group(2), [x.strip() for x in match.group(3).split(",")])
+    match = CONTEXT.match(code)
+    if match:
+        return ContextNode(context_hints(match.group(1), line))
+    match = CACHE.match(code)
+    if match:
+        return CacheNode(match.group(1))
     if not code.endswith(":"):
         code = code + ":"
     return ControlNode(code)
 
 
+def context_hints(data, line):
+    # "name: type, other: dict[str, int]" -> {name: type}, commas inside
+    # brackets belong to the type
+    hints = {}
+    depth = 0
+    start = 0
+    for pos, char in enumerate(data + ","):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == "," and not depth:
+            name, colon, hint = data[start:pos].partition(":")
+            start = pos + 1
+            if not name.strip() and not colon:
+                continue
+            if not colon or not name.strip() or not hint.strip():
+                raise RuntimeError("bad context hint near line %s" % line.num)
+            hints[name.strip()] = hint.strip()
+    return hints
+
+
 def line_to_output(line):
-    return OutputNode(line.content[1:].strip())
+    expr = line.content[1:].strip()
+    match = OUTPUT_HINT.match(expr)
+    if match:
+        return OutputNode(match.group(1), match.group(2).strip())
+    return OutputNode(expr)
 
 
 def line_to_statement(line):
@@ -171,31 +215,39 @@ def line_to_text(line):
     return TextNode(line.content)
 
 
-def fold(tree):
-    result = []
-    ctrl = None
-    for item in tree:
-
-        if isinstance(item, ControlNode) or isinstance(item, TagNode):
-            item.children = fold(item.children)
-
-        if isinstance(item, ControlNode):
-            if item.code == "else:":
-                if not ctrl:
-                    raise RuntimeError("unblanced else near line %s" % item.line.num )
-                ctrl.orelse = item.children
-            else:
-                result.append(item)
-                ctrl = item
-        else:
-            ctrl = None
-            result.append(item)
-
-    return result
-
-
 def parse(source):
-    lines = parse_lines(source)
-    tree = make_tree(lines)
-    nodetree = linetree_to_nodetree(tree)
-    return fold(nodetree)
+    # one pass over the lines, nodes go straight into the children list
+    # of the block their indent opens; blocks[n] is None when the line
+    # owning level n can't have children
+    roots = []
+    blocks = [roots]
+    owners = [None]
+    for num, data in enumerate(source.split("\n"), 1):
+        content = data.lstrip()
+        indent = len(data) - len(content)
+        content = content.rstrip()
+        if not content or content[0] == "/":
+            continue
+        if indent % 2:
+            raise IndentationError("bad indent on line %s" % num)
+        level = indent // 2
+        if level >= len(blocks):
+            raise IndentationError("bad indent on line %s" % num)
+        block = blocks[level]
+        if block is None:
+            raise RuntimeError("bad nesting near line %s" % owners[level].line.num)
+        del blocks[level + 1:]
+        del owners[level + 1:]
+
+        line = Line(num, level, content, None)
+        node = line_to_node(line)
+        if isinstance(node, ControlNode) and node.code == "else:":
+            ctrl = block[-1] if block else None
+            if not isinstance(ctrl, ControlNode):
+                raise RuntimeError("unblanced else near line %s" % num)
+            ctrl.orelse = node.children
+        else:
+            block.append(node)
+        blocks.append(getattr(node, "children", None))
+        owners.append(node)
+    return roots
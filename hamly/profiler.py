@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import argparse
+
+from .loader import compile_template, read_source
+
+
+def profile_template(filename, **options):
+    stats = {}
+    compile_template(read_source(filename), filename, options=options, stats=stats)
+    return stats
+
+
+def format_report(filename, stats):
+    optimizer = stats["optimizer"]
+    lines = [filename]
+    for key in ("parse", "compile_tree", "optimize", "compile"):
+        lines.append("  %-28s %9.2f ms" % (key, stats[key] * 1000))
+    lines.append("  %-28s %9s %5s %7s %7s" % ("pass", "ms", "iter", "nodes", "after"))
+    for item in optimizer["passes"]:
+        lines.append("  %-28s %9.2f %5i %7i %7i" % (item["name"], item["time"] * 1000,
+                                                   item["iterations"], item["nodes_before"],
+                                                   item["nodes_after"]))
+    for event, number in sorted(optimizer["counters"].items()):
+        lines.append("  %-28s %9i" % (event, number))
+    lines.append("  %-28s %9i bytes" % ("code_size", stats["code_size"]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m hamly.profiler",
+                                     description="report where template compile time goes")
+    parser.add_argument("templates", nargs="+")
+    parser.add_argument("--json", action="store_true", help="print stats as json")
+    parser.add_argument("--format-writes", action="store_true")
+    parser.add_argument("--unroll-budget", type=int,
+                        help="ast nodes loop unrolling may add")
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.format_writes:
+        options["format_writes"] = True
+    if args.unroll_budget is not None:
+        options["unroll_budget"] = args.unroll_budget
+
+    report = {}
+    for filename in args.templates:
+        report[filename] = profile_template(filename, **options)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        print("\n\n".join(format_report(x, report[x]) for x in args.templates))
+
+
+if __name__ == "__main__":
+    main()
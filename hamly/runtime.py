@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# what compiled templates need to run, without the compiler; modules
+# written by hamly.compile only import this
+
+import sys
+import threading
+
+from six import exec_
+
+from .escape import escape, quoteattr, soft_unicode, encode, number, number_attr
+from .html import write_attrs, write_attrs_bytes, write_merged_attrs, write_merged_attrs_bytes
+from .cache import FragmentCache, Fragments
+from .stream import ChunkBuffer, CHUNK_SIZE
+from .const import (WRITE, TO_STRING, ESCAPE, WRITE_MULTI,
+                    QUOTEATTR, WRITE_ATTRS, FLUSH, ENCODE,
+                    WRITE_ATTRS_BYTES, FRAGMENTS, FRAGMENTS_BYTES,
+                    MERGE_ATTRS, MERGE_ATTRS_BYTES, NUMBER, NUMBER_ATTR)
+
+RENDER = "render"
+STREAM = "stream"
+BYTES = "bytes"
+BYTES_STREAM = "bytes_stream"
+
+fragment_cache = FragmentCache()
+
+TEMPLATE_GLOBALS = {
+    ESCAPE: escape,
+    QUOTEATTR: quoteattr,
+    NUMBER: number,
+    NUMBER_ATTR: number_attr,
+    TO_STRING: soft_unicode,
+    WRITE_ATTRS: write_attrs,
+    WRITE_ATTRS_BYTES: write_attrs_bytes,
+    MERGE_ATTRS: write_merged_attrs,
+    MERGE_ATTRS_BYTES: write_merged_attrs_bytes,
+    ENCODE: encode,
+    FRAGMENTS: Fragments(fragment_cache, u"".join, "text"),
+    FRAGMENTS_BYTES: Fragments(fragment_cache, b"".join, "bytes"),
+}
+
+
+def configure_fragment_cache(maxsize=1000, ttl=None, backend=None):
+    # applies to loaded templates too, they find the store through the
+    # Fragments objects bound into them
+    global fragment_cache
+    if backend is None:
+        backend = FragmentCache(maxsize, ttl)
+    fragment_cache = backend
+    for name in (FRAGMENTS, FRAGMENTS_BYTES):
+        TEMPLATE_GLOBALS[name].backend = backend
+
+
+def fragment_stats():
+    # {block: {"hits": n, "misses": n}}, text and bytes renders added up
+    result = {}
+    for name in (FRAGMENTS, FRAGMENTS_BYTES):
+        for block, counters in TEMPLATE_GLOBALS[name].stats().items():
+            total = result.setdefault(block, {"hits": 0, "misses": 0})
+            total["hits"] += counters["hits"]
+            total["misses"] += counters["misses"]
+    return result
+
+
+def code_size(code):
+    size = len(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            size += code_size(const)
+    return size
+
+
+ENTRY = """
+def render_args(%(args)s):
+    output = []
+    main(%(args)s%(sep)soutput.append, output.extend)
+    return concat(output)
+"""
+
+
+def main_arguments(main):
+    # context names come first in a fixed (sorted) order, then the writers
+    code = main.__code__
+    names = code.co_varnames[:code.co_argcount]
+    return names[:names.index(WRITE)]
+
+
+def make_entry(main, arguments, concat):
+    # a positional render with the parameter list of main spelled out,
+    # python checks the arity and no dict is built per call
+    scope = {"main": main, "concat": concat}
+    args = ", ".join(arguments)
+    exec_(ENTRY % {"args": args, "sep": ", " if args else ""}, scope)
+    return scope["render_args"]
+
+
+def wrap_template(variants, load=None):
+    variants = dict(variants)
+    concat = "".join
+    concat_bytes = b"".join
+    lock = threading.Lock()
+
+    def variant(mode):
+        main = variants.get(mode)
+        if main is None:
+            if load is None:
+                raise ValueError("template wasn't compiled for %s mode" % mode)
+            with lock:
+                main = variants.get(mode)
+                if main is None:
+                    main = variants[mode] = load(mode)
+        return main
+
+    main_fun = variants.get(RENDER)
+    if main_fun is None:
+        # modules written by hamly.compile may hold any subset of the
+        # modes, text renders then fail like any other missing mode
+        def main_fun(*args, **kwargs):
+            return variant(RENDER)(*args, **kwargs)
+    compiled = [variants[x] for x in (RENDER, BYTES, STREAM, BYTES_STREAM) if x in variants][0]
+
+    def render(**kwargs):
+        output = []
+        main_fun(_h_write=output.append, _h_write_multi=output.extend, **kwargs)
+        return concat(output)
+
+    def render_bytes(**kwargs):
+        output = []
+        variant(BYTES)(_h_write=output.append, _h_write_multi=output.extend, **kwargs)
+        return concat_bytes(output)
+
+    def _generate(mode, buf, kwargs):
+        context = {WRITE: buf.parts.append, WRITE_MULTI: buf.parts.extend,
+                   FLUSH: buf.ready}
+        context.update(kwargs)
+        for chunk in variant(mode)(**context):
+            yield chunk
+        if buf.parts:
+            yield buf.flush()
+
+    def generate(chunk_size=CHUNK_SIZE, **kwargs):
+        return _generate(STREAM, ChunkBuffer(chunk_size, concat), kwargs)
+
+    def generate_bytes(chunk_size=CHUNK_SIZE, **kwargs):
+        return _generate(BYTES_STREAM, ChunkBuffer(chunk_size, concat_bytes), kwargs)
+
+    def render_to(stream, chunk_size=CHUNK_SIZE, **kwargs):
+        write = stream.write
+        for chunk in generate(chunk_size, **kwargs):
+            write(chunk)
+
+    def render_bytes_to(stream, chunk_size=CHUNK_SIZE, **kwargs):
+        write = stream.write
+        for chunk in generate_bytes(chunk_size, **kwargs):
+            write(chunk)
+
+    def specialization_stats():
+        # replaced by the specializer of templates loaded adaptively
+        return {"status": "off"}
+
+    def render_async(sink, chunk_size=CHUNK_SIZE, executor=None, **kwargs):
+        if sys.version_info < (3, 4):
+            raise RuntimeError("render_async needs python 3.4+")
+        from .aio import render_async
+        return render_async(render, sink, chunk_size, executor, kwargs)
+
+    setattr(render, "template_source", "")
+    setattr(render, "compile_stats", None)
+    setattr(render, "dependencies", [])
+    setattr(render, "static_context", {})
+    setattr(render, "specialization_stats", specialization_stats)
+    setattr(render, "code_size", code_size(compiled.__code__))
+    setattr(render, "generate", generate)
+    setattr(render, "render_to", render_to)
+    setattr(render, "render_bytes", render_bytes)
+    setattr(render, "generate_bytes", generate_bytes)
+    setattr(render, "render_bytes_to", render_bytes_to)
+    setattr(render, "render_async", render_async)
+    setattr(render, "arguments", main_arguments(compiled))
+    setattr(render, "render_args", make_entry(main_fun, render.arguments, concat))
+
+    return render
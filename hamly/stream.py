@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import ast
+
+from .const import FLUSH, CHUNK
+from .ast_utils import make_call, add_arg, copy_loc
+
+
+CHUNK_SIZE = 8192
+
+
+class ChunkBuffer(object):
+
+    def __init__(self, chunk_size=CHUNK_SIZE, concat="".join):
+        self.parts = []
+        self.chunk_size = chunk_size
+        self.concat = concat
+        self.size = 0
+        self.counted = 0
+
+    def flush(self):
+        chunk = self.concat(self.parts)
+        del self.parts[:]
+        self.size = 0
+        self.counted = 0
+        return chunk
+
+    def ready(self):
+        parts = self.parts
+        end = len(parts)
+        size = self.size
+        for index in range(self.counted, end):
+            size += len(parts[index])
+        if size >= self.chunk_size:
+            return self.flush()
+        self.size = size
+        self.counted = end
+
+
+def checkpoint():
+    return [ast.Assign([ast.Name(CHUNK, ast.Store())], make_call(FLUSH)),
+            ast.If(ast.Name(CHUNK, ast.Load()),
+                   [ast.Expr(ast.Yield(ast.Name(CHUNK, ast.Load())))], [])]
+
+
+class StreamingTransformer(ast.NodeTransformer):
+
+    def visit_FunctionDef(self, node):
+        return node
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        node.body.extend(copy_loc(checkpoint(), node))
+        return node
+
+    visit_While = visit_For
+
+
+def make_streaming(module):
+    main = module.body[0]
+    main.body = [StreamingTransformer().visit(x) for x in main.body]
+    main.body.extend(copy_loc(checkpoint(), main))
+    add_arg(main, FLUSH)
+    return module
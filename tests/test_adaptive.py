@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import hamly
+from hamly.loader import make_template
+
+
+SOURCE = u"%table\n  - for row in table\n    %tr\n      - for cell in row.values()\n        %td= cell\n%p= title\n"
+
+
+class AdaptiveTest(unittest.TestCase):
+
+    def tearDown(self):
+        hamly.configure_adaptive(0)
+
+    def test_off(self):
+        template = make_template(SOURCE, "adaptive.haml")
+        self.assertEqual(template.specialization_stats(), {"status": "off"})
+
+    def test_specialized(self):
+        hamly.configure_adaptive(samples=3, background=False)
+        template = make_template(SOURCE, "adaptive.haml")
+        self.assertEqual(template.specialization_stats()["status"], "sampling")
+        numbers = {"table": [{"a": 1}], "title": u"<t>"}
+        expected = u"<table>\n<tr>\n<td>\n1\n</td>\n</tr>\n</table>\n<p>\n&lt;t&gt;\n</p>\n"
+        for _ in range(4):
+            self.assertEqual(template(**numbers), expected)
+        stats = template.specialization_stats()
+        self.assertEqual(stats["status"], "specialized")
+        self.assertEqual(stats["hints"], {"table": "list[dict[str, int]]"})
+        self.assertEqual((stats["sampled"], stats["specialized"]), (3, 1))
+        # the guard only checks the outer type, inner values are still
+        # escaped when they turn out not to be numbers
+        self.assertEqual(template(table=[{"a": u"<"}], title=u""),
+                         u"<table>\n<tr>\n<td>\n&lt;\n</td>\n</tr>\n</table>\n<p>\n\n</p>\n")
+        self.assertEqual(template.render_args([{"a": 2}], u"t"), expected.replace(u"1", u"2").replace(u"&lt;t&gt;", u"t"))
+        template(table=({"a": 1}, ), title=u"")
+        self.assertEqual(template.specialization_stats()["guard_misses"], 1)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from hamly.loader import make_template
+
+
+SOURCE = u"%ul\n  - for i in items\n    %li= name\n"
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.chunks = []
+        self.drains = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+
+    def drain(self):
+        import asyncio
+        self.drains += 1
+        return asyncio.sleep(0)
+
+
+class RenderAsyncTest(unittest.TestCase):
+
+    @unittest.skipIf(sys.version_info < (3, 4), "needs asyncio")
+    def test_render_async(self):
+        import asyncio
+        template = make_template(SOURCE, "async.haml")
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            sink = Sink()
+            name = asyncio.sleep(0, result=u"caf\xe9")
+            loop.run_until_complete(template.render_async(sink, chunk_size=20, items=range(10), name=name))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertTrue(len(sink.chunks) > 1)
+        self.assertEqual(sink.drains, len(sink.chunks))
+        self.assertEqual(b"".join(sink.chunks), template(items=range(10), name=u"caf\xe9").encode("utf-8"))
+
+    @unittest.skipIf(sys.version_info >= (3, 4), "asyncio is there")
+    def test_unsupported(self):
+        template = make_template(SOURCE, "async.haml")
+        self.assertRaises(RuntimeError, template.render_async, None)
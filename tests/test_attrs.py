@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from hamly import html
+from hamly.loader import make_template
+
+
+SOURCE = (u"- for k, v in pairs\n"
+          u"  %a.btn{k: v, 'class': cls, 'href': url, 'title': \"a'b\"}\n    x\n"
+          u"  %b{k: v}\n"
+          u"  %i(('class', 'z'), ('class', cls), ('id', 1))\n")
+
+
+def reference(attrs):
+    output = []
+    html.write_attrs(attrs, output.append)
+    return u"".join(output)
+
+
+class MergedAttributesTest(unittest.TestCase):
+
+    def test_dynamic_names(self):
+        # attributes with names known at render time only come out like
+        # the generic writer puts them
+        template = make_template(SOURCE, "attrs.haml")
+        pairs = [("data-x", "<1>"), ("class", "extra"), ("aa", 2), ("", "skip"), ("zz%s", "p")]
+        context = {"pairs": pairs, "url": "/u?a=1&b=2", "cls": "c&d"}
+        output = template(**context)
+        self.assertEqual(template.render_bytes(**context), output.encode("utf-8"))
+        for k, v in pairs:
+            attrs = [("class", "btn"), ("href", context["url"]), ("title", "a'b"), (k, v), ("class", context["cls"])]
+            self.assertTrue(u"<a%s>" % reference(attrs) in output, reference(attrs))
+            self.assertTrue(u"<b%s>" % reference([(k, v)]) in output)
+        self.assertTrue(u"<i%s>" % reference([("class", "z"), ("class", "c&d"), ("id", 1)]) in output)
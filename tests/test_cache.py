@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import hamly
+from hamly import loader
+from hamly.loader import make_template
+
+
+class FragmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        hamly.configure_fragment_cache()
+        self.options = dict(loader.compile_options)
+
+    def tearDown(self):
+        hamly.configure_compiler(**self.options)
+        hamly.configure_fragment_cache()
+
+    def test_hits(self):
+        template = make_template(u"- cache user\n  %h1= user\n  %p= n\n%i= n\n", "hits.haml")
+        self.assertEqual(template(user=u"<a>", n=1), u"<h1>\n&lt;a&gt;\n</h1>\n<p>\n1\n</p>\n<i>\n1\n</i>\n")
+        self.assertEqual(template(user=u"<a>", n=2), u"<h1>\n&lt;a&gt;\n</h1>\n<p>\n1\n</p>\n<i>\n2\n</i>\n")
+        self.assertEqual(template.render_bytes(user=u"<a>", n=3), b"<h1>\n&lt;a&gt;\n</h1>\n<p>\n3\n</p>\n<i>\n3\n</i>\n")
+        self.assertEqual(u"".join(template.generate(user=u"b", n=4)), u"<h1>\nb\n</h1>\n<p>\n4\n</p>\n<i>\n4\n</i>\n")
+        self.assertEqual(hamly.loader.fragment_stats()["hits.haml:1"], {"hits": 1, "misses": 3})
+
+    def test_nested(self):
+        template = make_template(u"- cache 1\n  - for i in range(n)\n    - cache i\n      %b= i * x\n", "nested.haml")
+        self.assertEqual(template(n=2, x=1), u"<b>\n0\n</b>\n<b>\n1\n</b>\n")
+        self.assertEqual(template(n=3, x=2), u"<b>\n0\n</b>\n<b>\n1\n</b>\n")
+
+    def test_cache_in_def(self):
+        # a cache block must not turn the writers into locals of the def
+        template = make_template(u"- def card(title)\n  - cache title\n    %h1= title\n"
+                                 u"+ card(title='a')\n+ card(title='a')\n", "cache_in_def.haml")
+        self.assertEqual(template(), u"<h1>\na\n</h1>\n" * 2)
+        self.assertEqual(template.render_bytes(), b"<h1>\na\n</h1>\n" * 2)
+
+    def test_macros(self):
+        # defs that aren't inlined write into the fragment too
+        template = make_template(u"- def card(title)\n  %h1= title\n- cache k\n  %div\n  + card(title=t)\n%p= t\n",
+                                 "macros.haml")
+        expected = u"<div>\n</div>\n<h1>\na\n</h1>\n<p>\na\n</p>\n"
+        for _ in range(2):
+            self.assertEqual(template(k=1, t=u"a"), expected)
+            self.assertEqual(template.render_bytes(k=1, t=u"a"), expected.encode("utf-8"))
+        template = make_template(u"- def icon(n)\n  %i= n\n- def card(title)\n  + icon(n=title)\n  %h1= title\n"
+                                 u"- def page(x)\n  - cache x\n    + card(title=x)\n  %hr\n+ page(x=t)\n",
+                                 "transitive.haml")
+        for _ in range(2):
+            self.assertEqual(template(t=u"a"), u"<i>\na\n</i>\n<h1>\na\n</h1>\n<hr>\n</hr>\n")
+        self.assertRaises(RuntimeError, make_template,
+                          u"- def item(*args)\n  %b= args[0]\n- cache k\n  + item(k)\n", "varargs.haml")
+
+    def test_formatted_writes(self):
+        # bytes fragments can't be formatted into text
+        hamly.configure_compiler(format_writes=True)
+        template = make_template(u"- cache 'k'\n  %p= title\n%i= title\n", "formatted.haml")
+        expected = u"<p>\ncaf\xe9\n</p>\n<i>\ncaf\xe9\n</i>\n".encode("utf-8")
+        self.assertEqual(template.render_bytes(title=u"caf\xe9"), expected)
+        self.assertEqual(template.render_bytes(title=u"caf\xe9"), expected)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from six import exec_
+
+from hamly.loader import make_template
+from hamly.compile import compile_directory
+
+
+TEMPLATES = {
+    "page.haml": u"%ul\n  - for item in items\n    %li{'title': item}= item\n%p caf\xe9\n",
+    "sub/partial.haml": u"- def label(text)\n  %b= text\n+ label(count)\n%i= count * 2\n",
+}
+
+CONTEXT = {
+    "page.haml": {"items": [1, u"<a>"]},
+    "sub/partial.haml": {"count": 3},
+}
+
+
+def load_module(path):
+    scope = {"__name__": "compiled_templates"}
+    with open(path, "rb") as fp:
+        exec_(compile(fp.read(), path, "exec"), scope)
+    return scope
+
+
+class CompileDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, source in TEMPLATES.items():
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as fp:
+                fp.write(source.encode("utf-8"))
+        self.output = os.path.join(self.directory, "compiled_templates.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_output(self):
+        names = compile_directory(self.directory, self.output)
+        self.assertEqual(names, ["page.haml", "sub/partial.haml"])
+        module = load_module(self.output)
+        for name in names:
+            compiled = module["get_template"](name)
+            template = make_template(TEMPLATES[name], name)
+            context = CONTEXT[name]
+            self.assertEqual(compiled(**context), template(**context))
+            self.assertEqual(compiled.render_bytes(**context), template.render_bytes(**context))
+            self.assertEqual(list(compiled.generate(chunk_size=10, **context)),
+                             list(template.generate(chunk_size=10, **context)))
+            self.assertEqual(list(compiled.generate_bytes(chunk_size=10, **context)),
+                             list(template.generate_bytes(chunk_size=10, **context)))
+        self.assertTrue(module["get_template"]("page.haml") is module["get_template"]("page.haml"))
+
+    def test_some_modes(self):
+        compile_directory(self.directory, self.output, ["bytes"])
+        compiled = load_module(self.output)["get_template"]("sub/partial.haml")
+        self.assertEqual(compiled.render_bytes(count=3), b"<b>\n3\n</b>\n<i>\n6\n</i>\n")
+        self.assertRaises(ValueError, compiled, count=3)
+        self.assertRaises(ValueError, list, compiled.generate(count=3))
+        self.assertRaises(ValueError, compile_directory, self.directory, self.output, ["html"])
+
+    def test_no_compiler_at_runtime(self):
+        compile_directory(self.directory, self.output)
+        script = ("import sys, compiled_templates\n"
+                  "compiled_templates.get_template('page.haml')(items=[1])\n"
+                  "sys.stdout.write(' '.join(sorted(x for x in sys.modules if x.startswith('hamly.'))))\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([self.directory, root] + sys.path))
+        modules = subprocess.check_output([sys.executable, "-c", script], env=env).decode("ascii").split()
+        for name in ("hamly.parser", "hamly.compiler", "hamly.optimizer", "hamly.include"):
+            self.assertTrue(name not in modules, modules)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import ast
+import unittest
+
+import hamly
+from hamly import loader
+from hamly.loader import make_template
+
+
+SOURCE = u"%ul\n  - for x in items\n    %li{'title': x}= x\n%p\n  caf\xe9 #{name}\n  = name\n"
+
+
+class FormatWritesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.options = dict(loader.compile_options)
+
+    def tearDown(self):
+        hamly.configure_compiler(**self.options)
+
+    def test_same_output(self):
+        context = {"items": [1, u"<x>"], "name": u"\xe9&"}
+        plain = make_template(SOURCE, "format.haml")
+        hamly.configure_compiler(format_writes=True)
+        formatted = make_template(SOURCE, "format.haml")
+        self.assertEqual(formatted(**context), plain(**context))
+        self.assertEqual(formatted.render_bytes(**context), plain(**context).encode("utf-8"))
+        self.assertEqual(b"".join(formatted.generate_bytes(chunk_size=10, **context)),
+                         plain(**context).encode("utf-8"))
+        if not hasattr(ast, "JoinedStr"):
+            # there is nothing to format with
+            self.assertEqual(formatted.template_source, plain.template_source)
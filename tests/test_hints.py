@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from hamly.loader import make_template
+
+
+SOURCE = (u"-# context rows: list[dict[str, int]], n: int,\n"
+          u"-# context price: float\n"
+          u"%p= n\n"
+          u"%p{'data-n': n}= price\n"
+          u"- for i, row in enumerate(rows)\n"
+          u"  %b= i\n"
+          u"  - for k, v in row.items()\n"
+          u"    %i{'title': k}= v\n"
+          u"  = row['a'] * 2\n"
+          u"  = row.get('x')  #: int\n"
+          u"  = label\n")
+
+
+class TypeHintTest(unittest.TestCase):
+
+    def test_numbers(self):
+        template = make_template(SOURCE, "hints.haml")
+        output = template(rows=[{"a": 1}], n=3, price=1.5, label=u"<l>")
+        self.assertEqual(output, u"<p>\n3\n</p>\n<p data-n='3'>\n1.5\n</p>\n<b>\n0\n</b>\n"
+                                 u"<i title='a'>\n1\n</i>\n2\nNone\n&lt;l&gt;\n")
+        self.assertTrue("_h_escape(n)" not in template.template_source)
+
+    def test_wrong_hints(self):
+        # a hint is a promise only, other values are still escaped
+        template = make_template(SOURCE, "hints.haml")
+        context = {"rows": [{"a": u"<s>", "x": u"<x>"}], "n": u"<n>", "price": u"&", "label": u""}
+        output = template(**context)
+        for text in (u"&lt;s&gt;&lt;s&gt;", u"&lt;x&gt;", u"&lt;n&gt;", u"data-n='&lt;n&gt;'", u"\n&amp;\n"):
+            self.assertTrue(text in output, text)
+        self.assertEqual(template.render_bytes(**context), output.encode("utf-8"))
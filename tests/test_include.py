@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hamly
+from hamly import loader
+
+
+FILES = {
+    "parts/header.haml": u"%h1= title\n- include \"sub.haml\"\n",
+    "parts/sub.haml": u"%small sub\n",
+    "macros.haml": (u"- def button(label)\n  %i= label\n- def helper()\n  %i imported\n"
+                    u"- def icon(name)\n  %span= name\n- def field(name)\n  + icon(name)\n  %input\n"),
+    "page.haml": u"- include \"parts/header.haml\"\n- from \"macros.haml\" import button\n+ button(title)\n",
+    "local.haml": u"- def helper()\n  %b local\n- from \"macros.haml\" import button\n+ helper()\n+ button(\"x\")\n",
+    "twice.haml": (u"- from \"macros.haml\" import field\n- from \"macros.haml\" import field, button\n"
+                   u"+ field(\"f\")\n"),
+    "clash.haml": u"- def icon(n)\n  %b= n\n- from \"macros.haml\" import field\n+ field(\"f\")\n",
+    "missing.haml": u"- from \"macros.haml\" import nothing\n",
+    "loop.haml": u"- include \"loop.haml\"\n",
+}
+
+
+class IncludeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, source in FILES.items():
+            self.write(name, source)
+        loader.cache.clear()
+
+    def tearDown(self):
+        loader.cache.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, source):
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fp:
+            fp.write(source.encode("utf-8"))
+
+    def template(self, name):
+        return hamly.get_template(os.path.join(self.directory, name))
+
+    def test_include_and_import(self):
+        template = self.template("page.haml")
+        self.assertEqual(template(title=u"<t>"),
+                         u"<h1>\n&lt;t&gt;\n</h1>\n<small>\nsub\n</small>\n<i>\n&lt;t&gt;\n</i>\n")
+        self.assertEqual(sorted(os.path.relpath(x, self.directory) for x in template.dependencies),
+                         ["macros.haml", os.path.join("parts", "header.haml"), os.path.join("parts", "sub.haml")])
+
+    def test_only_named_defs(self):
+        self.assertEqual(self.template("local.haml")(), u"<b>\nlocal\n</b>\n<i>\nx\n</i>\n")
+        # defs a macro calls come along, once
+        self.assertEqual(self.template("twice.haml")(), u"<span>\nf\n</span>\n<input>\n</input>\n")
+
+    def test_errors(self):
+        for name, message in [("clash.haml", "icon"), ("missing.haml", "nothing"), ("loop.haml", "recursive")]:
+            try:
+                self.template(name)
+            except RuntimeError as e:
+                self.assertTrue(message in str(e), str(e))
+            else:
+                self.fail("%s compiled" % name)
+
+    def test_reload(self):
+        hamly.configure_cache(auto_reload=True, check_interval=0)
+        try:
+            template = self.template("page.haml")
+            self.write("parts/sub.haml", u"%small changed\n")
+            stamp = os.path.getmtime(os.path.join(self.directory, "parts", "sub.haml")) + 5
+            os.utime(os.path.join(self.directory, "parts", "sub.haml"), (stamp, stamp))
+            self.assertTrue(u"changed" in self.template("page.haml")(title=u"t"))
+            self.assertFalse(u"changed" in template(title=u"t"))
+        finally:
+            hamly.configure_cache()
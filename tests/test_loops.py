@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from hamly.loader import make_template
+
+
+TABLE = u"%table\n  - for row in rows\n    %tr\n      - for cell in row\n        %td= cell\n"
+
+LIST = u"%ul\n  - for i in items\n    %li= i\n"
+
+INVARIANT = u"%ul\n  - for item in items\n    %li= user.name\n"
+
+
+class User(object):
+
+    def __init__(self, name):
+        self._name = name
+        self.reads = 0
+
+    @property
+    def name(self):
+        self.reads += 1
+        return self._name
+
+
+class LoopWriteTest(unittest.TestCase):
+
+    def test_lowered_loops(self):
+        template = make_template(TABLE, "table.haml")
+        rows = [[1, u"<"], [], [u"&"]]
+        expected = (u"<table>\n<tr>\n<td>\n1\n</td>\n<td>\n&lt;\n</td>\n</tr>\n"
+                    u"<tr>\n</tr>\n<tr>\n<td>\n&amp;\n</td>\n</tr>\n</table>\n")
+        self.assertEqual(template(rows=rows), expected)
+        self.assertEqual(template.render_bytes(rows=rows), expected.encode("utf-8"))
+        self.assertEqual(u"".join(template.generate(chunk_size=10, rows=rows)), expected)
+
+    def test_streaming_keeps_outer_loops(self):
+        # chunks are handed out at the end of iterations of the outermost loop
+        template = make_template(LIST, "list.haml")
+        items = list(range(2000))
+        chunks = list(template.generate(chunk_size=100, items=items))
+        self.assertTrue(len(chunks) > 100)
+        self.assertTrue(max(len(x) for x in chunks) < 200)
+        self.assertEqual(u"".join(chunks), template(items=items))
+        chunks = list(template.generate_bytes(chunk_size=100, items=items))
+        self.assertTrue(len(chunks) > 100)
+        template = make_template(TABLE, "table.haml")
+        chunks = list(template.generate(chunk_size=100, rows=[list(range(10))] * 100))
+        self.assertTrue(len(chunks) > 50)
+
+
+class LoopInvariantTest(unittest.TestCase):
+
+    def test_hoisted_once(self):
+        template = make_template(INVARIANT, "invariant.haml")
+        user = User(u"<a>")
+        self.assertEqual(template(items=[1, 2, 3], user=user), u"<ul>\n" + u"<li>\n&lt;a&gt;\n</li>\n" * 3 + u"</ul>\n")
+        self.assertEqual(user.reads, 1)
+
+    def test_empty_loop(self):
+        # invariant values of a loop body are only computed once it runs
+        template = make_template(INVARIANT, "invariant.haml")
+        self.assertEqual(template(items=[], user=None), u"<ul>\n</ul>\n")
+        self.assertEqual(template.render_bytes(items=[], user=None), b"<ul>\n</ul>\n")
+
+    def test_break(self):
+        template = make_template(u"%ul\n  - for x in items\n    - if x\n      - break\n    %li= user.name\n",
+                                 "break.haml")
+        self.assertEqual(template(items=[1], user=None), u"<ul>\n</ul>\n")
+        self.assertEqual(template(items=[0, 0, 1], user=User(u"a")), u"<ul>\n" + u"<li>\na\n</li>\n" * 2 + u"</ul>\n")
+
+
+class UnrollTest(unittest.TestCase):
+
+    def test_unrolled(self):
+        template = make_template(u"- for i in range(3)\n  %b= i * 2\n", "unroll.haml")
+        self.assertEqual(template(), u"<b>\n0\n</b>\n<b>\n2\n</b>\n<b>\n4\n</b>\n")
+        self.assertTrue("for" not in template.template_source)
+
+    def test_huge_loops(self):
+        # static loops too long to unroll are neither built as lists nor
+        # run to the end at compile time
+        template = make_template(u"- for i in range(30000000)\n  %p= i\n", "huge_range.haml")
+        self.assertTrue("for" in template.template_source)
+        template = make_template(u"- for i in range(10000000000)\n  + x = i\n%p ok\n", "huge_loop.haml")
+        self.assertTrue("for" in template.template_source)
+
+    def test_folded_loop_names(self):
+        # a loop run at compile time leaves its names bound
+        template = make_template(u"- for i in range(50000)\n  + x = i\n  %b\n= x\n", "folded.haml")
+        self.assertEqual(template()[-7:], u"\n49999\n")
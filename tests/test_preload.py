@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hamly
+from hamly import loader
+
+
+class PreloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for index in range(4):
+            with open(os.path.join(self.directory, "t%i.haml" % index), "w") as fp:
+                fp.write("%%p= x * %i\n" % index)
+        with open(os.path.join(self.directory, "bad.haml"), "w") as fp:
+            fp.write("%p\n   - x\n")
+        loader.cache.clear()
+
+    def tearDown(self):
+        hamly.set_bytecode_cache(None)
+        loader.cache.clear()
+        shutil.rmtree(self.directory)
+
+    def test_preload(self):
+        report = hamly.preload(self.directory, workers=2)
+        names = sorted(os.path.basename(x) for x in report["templates"])
+        self.assertEqual(names, ["t0.haml", "t1.haml", "t2.haml", "t3.haml"])
+        self.assertEqual([os.path.basename(x) for x in report["failures"]], ["bad.haml"])
+        self.assertFalse(any(x["cached"] for x in report["templates"].values()))
+        filename = os.path.join(self.directory, "t3.haml")
+        template = hamly.get_template(filename)
+        self.assertTrue(loader.cache.get(filename) is template)
+        self.assertEqual(template(x=2), u"<p>\n6\n</p>\n")
+
+    def test_bytecode_cache(self):
+        hamly.set_bytecode_cache(os.path.join(self.directory, "cache"))
+        hamly.preload(self.directory, workers=2)
+        loader.cache.clear()
+        report = hamly.preload(self.directory, workers=2)
+        self.assertTrue(all(x["cached"] for x in report["templates"].values()))
+        self.assertEqual(hamly.get_template(os.path.join(self.directory, "t1.haml"))(x=5), u"<p>\n5\n</p>\n")
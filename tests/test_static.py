@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import hamly
+from hamly import loader
+
+
+SOURCE = (u"- for lang in LANGS\n"
+          u"  %a{\"href\": \"/\" + lang, 'class': 'on' if lang == LOCALE else 'off'}= NAMES[lang]\n"
+          u"- if FLAGS['beta']\n  %p beta for #{SITE}\n- else\n  %p= SITE\n"
+          u"%b= user\n"
+          u"- for SITE in [1]\n  = SITE\n")
+
+STATIC = {"LANGS": ["en", "de"], "LOCALE": "de", "NAMES": {"en": "English", "de": "Deutsch <3"},
+          "FLAGS": {"beta": False}, "SITE": "x&y"}
+
+
+class StaticContextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "static.haml")
+        with open(self.filename, "wb") as fp:
+            fp.write(SOURCE.encode("utf-8"))
+        loader.cache.clear()
+
+    def tearDown(self):
+        loader.cache.clear()
+        shutil.rmtree(self.directory)
+
+    def test_same_output(self):
+        static = hamly.get_template(self.filename, static_context=STATIC)
+        plain = hamly.get_template(self.filename)
+        context = dict(STATIC, user=u"<u>")
+        self.assertEqual(static(user=u"<u>"), plain(**context))
+        self.assertEqual(static.render_bytes(user=u"<u>"), plain.render_bytes(**context))
+        self.assertEqual(u"".join(static.generate(user=u"<u>")), plain(**context))
+        self.assertEqual(static.arguments, ("user", ))
+        # the loop over a static list is unrolled
+        self.assertTrue("LANGS" not in static.template_source)
+
+    def test_cached_per_context(self):
+        static = hamly.get_template(self.filename, static_context=STATIC)
+        self.assertTrue(hamly.get_template(self.filename, static_context=dict(STATIC)) is static)
+        english = hamly.get_template(self.filename, static_context=dict(STATIC, LOCALE="en"))
+        self.assertFalse(english is static)
+        self.assertTrue(u"class='on' href='/en'" in english(user=1))
+
+    def test_literals_only(self):
+        self.assertRaises(TypeError, hamly.get_template, self.filename, static_context={"SITE": object()})